@@ -0,0 +1,465 @@
+"""Offline stand-in for Discord, to run the bot without a token.
+
+The bot uses a real discord.Client. FakeDiscord replaces its REST client (FakeHTTP,
+with a configurable latency) and its gateway, and keeps the "server side" data:
+guilds, channels, members and messages. Every REST call that changes something
+also sends the gateway event Discord would send, so the bot's caches and event
+handlers behave as in production.
+"""
+
+import re
+import random
+import asyncio
+import datetime
+import collections
+import types
+import urllib.parse
+
+import discord
+from discord.utils import time_snowflake
+
+from interactions import CHANNEL_MESSAGE, EPHEMERAL
+
+
+MENTION = re.compile(r'<@!?(\d+)>')
+MESSAGE_LIMIT = 2000 # characters
+
+
+def _error(cls, status, text):
+    return cls(types.SimpleNamespace(status=status, reason=text), text)
+
+
+def _check_length(content):
+    if content is not None and len(content) > MESSAGE_LIMIT:
+        raise _error(discord.HTTPException, 400, f'Invalid Form Body: content must be {MESSAGE_LIMIT} or fewer in length.')
+
+
+class FakeGateway:
+    """The bits of the websocket the bot uses."""
+
+    def __init__(self, world):
+        self.world = world
+
+    async def change_presence(self, *, activity=None, status=None, afk=False, since=0.0):
+        pass
+
+    async def request_chunks(self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None):
+        # Like Discord, match the start of usernames and nicknames
+        query = (query or '').lower()
+        members = [
+            member for member_id, member in self.world.members.items()
+            if (user_ids is None or member_id in user_ids) and (
+                member['user']['username'].lower().startswith(query) or
+                (member['nick'] or '').lower().startswith(query)
+            )
+        ][:limit or None]
+
+        # Answered after a round trip: discord.py starts waiting for the chunk after sending the request
+        self.world.gateway('parse_guild_members_chunk', {
+            'guild_id': str(guild_id), 'members': [ dict(member) for member in members ],
+            'nonce': nonce, 'chunk_index': 0, 'chunk_count': 1,
+        }, delay=max(self.world.http.latency, 0.001))
+
+
+class FakeHTTP:
+    """REST API, implementing the HTTPClient methods the bot uses."""
+
+    def __init__(self, world, latency=0.05, jitter=0.0):
+        self.world = world
+        self.latency = latency
+        self.jitter = jitter
+
+        self.calls = collections.Counter() # route -> number of requests
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    async def _request(self, route):
+        self.calls[route] += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # Messages
+
+    async def send_message(self, channel_id, content, *, tts=False, embed=None, nonce=None,
+                           allowed_mentions=None, message_reference=None):
+        await self._request('send_message')
+        _check_length(content)
+        return self.world.add_message(channel_id, self.world.bot_user, content, gateway=True)
+
+    async def get_message(self, channel_id, message_id):
+        await self._request('get_message')
+        return dict(self.world.find_message(channel_id, message_id))
+
+    async def logs_from(self, channel_id, limit, before=None, after=None, around=None):
+        await self._request('logs_from')
+
+        messages = self.world.messages[channel_id] # oldest first
+        if after is not None:
+            selected = [ m for m in messages if int(m['id']) > int(after) ][:limit]
+        else:
+            selected = [ m for m in messages if before is None or int(m['id']) < int(before) ][-limit:]
+
+        # Discord returns the newest first
+        return [ dict(m) for m in reversed(selected) ]
+
+    async def edit_message(self, channel_id, message_id, **fields):
+        await self._request('edit_message')
+        _check_length(fields.get('content'))
+
+        data = self.world.find_message(channel_id, message_id)
+        data.update(fields)
+        return dict(data)
+
+    async def pin_message(self, channel_id, message_id, reason=None):
+        await self._request('pin_message')
+        self.world.find_message(channel_id, message_id)['pinned'] = True
+
+    async def unpin_message(self, channel_id, message_id, reason=None):
+        await self._request('unpin_message')
+        self.world.find_message(channel_id, message_id)['pinned'] = False
+
+    async def delete_message(self, channel_id, message_id, *, reason=None):
+        await self._request('delete_message')
+        self.world.remove_messages(channel_id, { int(message_id) })
+
+    async def delete_messages(self, channel_id, message_ids, *, reason=None):
+        await self._request('delete_messages')
+        self.world.remove_messages(channel_id, { int(i) for i in message_ids })
+
+    # Channels
+
+    async def create_channel(self, guild_id, channel_type, *, reason=None, **options):
+        await self._request('create_channel')
+
+        data = self.world.channel_payload(
+            guild_id, options['name'], channel_type,
+            parent_id=options.get('parent_id'),
+            overwrites=options.get('permission_overwrites') or ()
+        )
+        self.world.gateway('parse_channel_create', self.world.channel_copy(data))
+        return self.world.channel_copy(data)
+
+    async def edit_channel(self, channel_id, *, reason=None, **options):
+        await self._request('edit_channel')
+
+        data = self.world.channels[channel_id]
+        if 'permission_overwrites' in options:
+            data['permission_overwrites'] = [
+                self.world.overwrite_payload(ow['id'], ow['type'], ow['allow'], ow['deny'])
+                for ow in options.pop('permission_overwrites')
+            ]
+        data.update(options)
+
+        self.world.gateway('parse_channel_update', self.world.channel_copy(data))
+        return self.world.channel_copy(data)
+
+    async def edit_channel_permissions(self, channel_id, target, allow, deny, type, *, reason=None):
+        await self._request('edit_channel_permissions')
+
+        data = self.world.channels[channel_id]
+        overwrites = [ ow for ow in data['permission_overwrites'] if int(ow['id']) != int(target) ]
+        overwrites.append(self.world.overwrite_payload(target, type, allow, deny))
+        data['permission_overwrites'] = overwrites
+
+        self.world.gateway('parse_channel_update', self.world.channel_copy(data))
+
+    async def delete_channel_permissions(self, channel_id, target, *, reason=None):
+        await self._request('delete_channel_permissions')
+
+        data = self.world.channels[channel_id]
+        data['permission_overwrites'] = [ ow for ow in data['permission_overwrites'] if int(ow['id']) != int(target) ]
+
+        self.world.gateway('parse_channel_update', self.world.channel_copy(data))
+
+    async def delete_channel(self, channel_id, *, reason=None):
+        await self._request('delete_channel')
+
+        data = self.world.channels.pop(channel_id)
+        self.world.messages.pop(channel_id, None)
+        self.world.gateway('parse_channel_delete', self.world.channel_copy(data))
+
+    # Application and interactions
+
+    async def application_info(self):
+        await self._request('application_info')
+        return {
+            'id': self.world.bot_user['id'], 'name': self.world.bot_user['username'], 'description': '',
+            'icon': None, 'bot_public': True, 'bot_require_code_grant': False, 'owner': self.world.bot_user,
+            'summary': '', 'verify_key': '',
+        }
+
+    async def request(self, route, **kwargs):
+        """Endpoints that discord.py doesn't wrap, used through raw Routes (interactions)."""
+        await self._request(f'{route.method} {route.path}')
+        json = kwargs.get('json')
+        if isinstance(json, dict):
+            _check_length(json.get('data', json).get('content'))
+
+        self.world.interaction_responses.append((route.method, route.path, kwargs.get('json')))
+
+        token = next((part for part in route.url.split('/') if part in self.world.interactions), None)
+        if token is not None:
+            return { 'id': str(self.world.interaction_message(token, route.method, route.url, kwargs['json'])) }
+        return { 'id': str(self.world.new_id()) }
+
+    # Members and roles
+
+    async def get_member(self, guild_id, member_id):
+        await self._request('get_member')
+
+        try:
+            return dict(self.world.members[int(member_id)])
+        except KeyError:
+            raise _error(discord.NotFound, 404, 'Unknown Member')
+
+    async def add_role(self, guild_id, user_id, role_id, *, reason=None):
+        await self._request('add_role')
+        self.world.update_member_roles(user_id, add=int(role_id))
+
+    async def remove_role(self, guild_id, user_id, role_id, *, reason=None):
+        await self._request('remove_role')
+        self.world.update_member_roles(user_id, remove=int(role_id))
+
+
+class FakeDiscord:
+    """Server-side data of a single guild, wired to a discord.Client."""
+
+    def __init__(self, client, latency=0.05, jitter=0.0):
+        self.client = client
+        self.state = client._connection
+
+        self.http = FakeHTTP(self, latency=latency, jitter=jitter)
+        client.http = self.state.http = self.http
+        client.ws = FakeGateway(self)
+
+        self.guild_id = None
+        self.bot_user = None
+        self.users = {} # id -> user payload
+        self.members = {} # id -> member payload
+        self.channels = {} # id -> channel payload
+        self.messages = collections.defaultdict(list) # channel id -> message payloads, oldest first
+        self.interaction_responses = [] # (method, route, json) of every interaction request
+        self.interactions = {} # token -> (channel id, its response messages)
+
+        self._last_id = 0
+
+    def new_id(self, when=None):
+        """A snowflake, always greater than the previous ones unless when is given."""
+        snowflake = time_snowflake(when or datetime.datetime.utcnow())
+        if when is not None:
+            return snowflake
+
+        self._last_id = max(self._last_id + 1, snowflake)
+        return self._last_id
+
+    def gateway(self, parser, data, delay=0):
+        """Send a gateway event to the client, right after the current REST call returns (or after delay)."""
+        asyncio.get_running_loop().call_later(delay, getattr(self.state, parser), data)
+
+    # Payloads
+
+    def user_payload(self, user_id, name, discriminator, bot=False):
+        user = self.users[user_id] = {
+            'id': str(user_id), 'username': name, 'discriminator': discriminator,
+            'avatar': None, 'bot': bot,
+        }
+        return user
+
+    def member_payload(self, user, nick=None, roles=()):
+        member = self.members[int(user['id'])] = {
+            'user': user, 'nick': nick, 'roles': [ str(role_id) for role_id in roles ],
+            'joined_at': datetime.datetime.utcnow().isoformat(), 'deaf': False, 'mute': False,
+        }
+        return member
+
+    @staticmethod
+    def overwrite_payload(target_id, type, allow, deny):
+        return {
+            'id': str(target_id), 'type': type,
+            'allow': str(allow), 'deny': str(deny),
+            'allow_new': str(allow), 'deny_new': str(deny),
+        }
+
+    def channel_payload(self, guild_id, name, channel_type=0, parent_id=None, overwrites=(), channel_id=None):
+        channel_id = channel_id or self.new_id()
+        data = self.channels[channel_id] = {
+            'id': str(channel_id), 'guild_id': str(guild_id), 'type': channel_type, 'name': name,
+            'parent_id': str(parent_id) if parent_id else None, 'position': len(self.channels),
+            'permission_overwrites': [
+                self.overwrite_payload(ow['id'], ow['type'], ow['allow'], ow['deny'])
+                for ow in overwrites
+            ],
+            'topic': None, 'nsfw': False, 'rate_limit_per_user': 0, 'last_message_id': None,
+        }
+        return data
+
+    @staticmethod
+    def channel_copy(data):
+        # discord.py consumes (pops from) the overwrites it receives
+        return dict(data, permission_overwrites=[ dict(ow) for ow in data['permission_overwrites'] ])
+
+    # Setup
+
+    def login(self, user_id, name='StaticBot', discriminator='0000'):
+        self.bot_user = self.user_payload(user_id, name, discriminator, bot=True)
+        self.state.user = discord.ClientUser(state=self.state, data=self.bot_user)
+
+    def create_guild(self, guild_id, roles, channel_ids=None):
+        """Create the guild in the client, with the members and channels created so far.
+
+        roles is a list of (id, name). The guild id is also the @everyone role.
+        """
+        self.guild_id = guild_id
+        self.member_payload(self.bot_user)
+
+        channel_ids = channel_ids if channel_ids is not None else list(self.channels)
+        data = {
+            'id': str(guild_id), 'name': 'Fake guild', 'owner_id': '0',
+            'member_count': len(self.members),
+            'roles': [
+                { 'id': str(role_id), 'name': name, 'permissions': '0', 'position': i }
+                for i, (role_id, name) in enumerate([ (guild_id, '@everyone') ] + list(roles))
+            ],
+            'members': list(self.members.values()),
+            'channels': [ self.channel_copy(self.channels[channel_id]) for channel_id in channel_ids ],
+        }
+
+        return self.state._add_guild_from_data(data)
+
+    def dm_channel(self, user_id):
+        """The DM channel between a user and the bot."""
+        channel = self.state._get_private_channel_by_user(user_id)
+        if channel is None:
+            channel_id = self.new_id()
+            self.channels[channel_id] = { 'id': str(channel_id), 'type': 1, 'recipients': [ self.users[user_id] ] }
+            channel = self.state.add_dm_channel(dict(self.channels[channel_id]))
+
+        return channel
+
+    # Messages
+
+    def add_message(self, channel_id, author, content, reference_id=None, when=None, gateway=False):
+        """Store a new message, returning its payload."""
+        channel_id = int(channel_id)
+        channel = self.channels[channel_id]
+
+        data = {
+            'id': str(self.new_id(when)), 'channel_id': str(channel_id), 'author': author,
+            'content': content, 'timestamp': (when or datetime.datetime.utcnow()).isoformat(),
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+            'mentions': [
+                self.users[int(user_id)] for user_id in MENTION.findall(content)
+                if int(user_id) in self.users
+            ],
+            'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+        }
+        if 'guild_id' in channel:
+            data['guild_id'] = channel['guild_id']
+            member = self.members.get(int(author['id']))
+            if member is not None:
+                data['member'] = { k: v for k, v in member.items() if k != 'user' }
+        if reference_id is not None:
+            data['message_reference'] = { 'message_id': str(reference_id), 'channel_id': str(channel_id) }
+
+        messages = self.messages[channel_id]
+        messages.append(data)
+        if len(messages) > 1 and int(messages[-2]['id']) > int(data['id']):
+            messages.sort(key=lambda m: int(m['id']))
+        channel['last_message_id'] = messages[-1]['id']
+
+        if gateway:
+            self.gateway('parse_message_create', dict(data))
+
+        return dict(data)
+
+    def post(self, channel, author_id, content, reference_id=None):
+        """A user sends a message: returns the discord.Message the bot receives."""
+        data = self.add_message(channel.id, self.users[author_id], content, reference_id=reference_id)
+
+        if isinstance(channel, discord.TextChannel):
+            channel.last_message_id = int(data['id'])
+
+        return self.state.create_message(channel=channel, data=data)
+
+    def interaction(self, channel, author_id, name, options=()):
+        """A user runs a slash command: returns the INTERACTION_CREATE payload the bot receives.
+
+        options is a list of (type, name, value). Members given as options are resolved.
+        """
+        member = self.members[author_id]
+        data = {
+            'id': str(self.new_id()), 'application_id': self.bot_user['id'], 'type': 2,
+            'token': f'token-{self._last_id}', 'guild_id': str(channel.guild.id),
+            'channel_id': str(channel.id), 'member': dict(member),
+            'data': {
+                'id': str(self.new_id()), 'name': name, 'type': 1,
+                'options': [ { 'type': type, 'name': option, 'value': value } for type, option, value in options ],
+                'resolved': { 'users': {}, 'members': {} },
+            },
+        }
+
+        for type, option, value in options:
+            if type == 6 and int(value) in self.members:
+                data['data']['resolved']['users'][value] = self.users[int(value)]
+                data['data']['resolved']['members'][value] = {
+                    k: v for k, v in self.members[int(value)].items() if k != 'user'
+                }
+
+        self.interactions[data['token']] = (channel.id, {})
+        return data
+
+    def interaction_message(self, token, method, path, payload):
+        """Like Discord, show the non-ephemeral responses of an interaction as messages of its channel.
+
+        Returns the id of the message created or edited.
+        """
+        channel_id, messages = self.interactions[token] # messages: id -> whether it is shown in the channel
+        data = payload.get('data', payload)
+        shown = not data.get('flags', 0) & EPHEMERAL
+
+        if path.endswith('/callback'):
+            # A deferred response shows a placeholder until it is edited
+            content = data['content'] if payload['type'] == CHANNEL_MESSAGE else f"{self.bot_user['username']} is thinking..."
+            message_id = messages['@original'] = self.response_message(channel_id, content, shown)
+        elif method == 'PATCH':
+            message_id = urllib.parse.unquote(path.rsplit('/', 1)[1])
+            message_id = messages['@original'] if message_id == '@original' else int(message_id)
+            if messages[str(message_id)]:
+                self.find_message(channel_id, message_id)['content'] = payload['content']
+        else:
+            message_id = self.response_message(channel_id, payload['content'], shown)
+
+        messages[str(message_id)] = shown
+        return message_id
+
+    def response_message(self, channel_id, content, shown):
+        if shown:
+            return int(self.add_message(channel_id, self.bot_user, content, gateway=True)['id'])
+        return self.new_id()
+
+    def find_message(self, channel_id, message_id):
+        for data in self.messages.get(int(channel_id), ()):
+            if int(data['id']) == int(message_id):
+                return data
+
+        raise _error(discord.NotFound, 404, 'Unknown Message')
+
+    def remove_messages(self, channel_id, message_ids):
+        messages = self.messages.get(int(channel_id), [])
+        messages[:] = [ m for m in messages if int(m['id']) not in message_ids ]
+
+    # Members
+
+    def update_member_roles(self, user_id, add=None, remove=None):
+        member = self.members[int(user_id)]
+
+        roles = [ role for role in member['roles'] if int(role) != remove ]
+        if add is not None and str(add) not in roles:
+            roles.append(str(add))
+        member['roles'] = roles
+
+        self.gateway('parse_guild_member_update', dict(member, guild_id=str(self.guild_id)))
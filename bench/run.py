@@ -0,0 +1,269 @@
+"""Replay scripted command traffic against the bot, offline, and report its performance.
+
+Usage (from the repository root):
+
+    python -m bench.run [--members 5000] [--statics 300] [--latency 0.02] [--json results.json]
+
+For every command it reports p50/p99 latency, REST calls per command and peak memory.
+With --baseline, it exits with an error if any of them regressed by more than --tolerance
+compared to a previous --json output, so it can be used in CI.
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+
+import bot
+from bench.fake_discord import FakeDiscord
+
+
+GUILD_ID = 1000
+CATEGORY_ID = 1001
+ADMIN_ROLE_ID = 1002
+BOTS_ROLE_ID = 1003
+BLACKLIST_ROLE_ID = 1004
+ONE_CHANNEL_ROLE_ID = 1005
+BOT_ID = 1010
+
+VIEW_CHANNEL = 1 << 10
+
+CONF = {
+    "GUILD_ID": GUILD_ID,
+    "CATEGORY_ID": CATEGORY_ID,
+    "ADMIN_ROLE_ID": ADMIN_ROLE_ID,
+    "BOTS_ROLE_ID": BOTS_ROLE_ID,
+    "BLACKLIST_ROLE_ID": BLACKLIST_ROLE_ID,
+    "WHITELIST_ROLE_ID": None,
+    "ONE_CHANNEL_ROLE_ID": ONE_CHANNEL_ROLE_ID,
+    "REGISTRY_PATH": ":memory:",
+    # Traffic comes from few simulated users, don't rate limit them
+    "USER_RATE_LIMIT": None,
+    "COMMAND_RATE_LIMIT": None,
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Bench:
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.results = {}
+
+    def setup(self):
+        args = self.args
+
+        client = bot.create_app(dict(CONF, LOW_MEMORY=args.low_memory))
+        self.world = world = FakeDiscord(client, latency=args.latency, jitter=args.jitter)
+        world.login(BOT_ID)
+
+        # Members: the first one is the admin
+        self.member_ids = []
+        for i in range(args.members):
+            user = world.user_payload(2000 + i, f'user{i}', f'{i % 10000:04d}')
+            world.member_payload(user, nick=f'Nick {i}' if i % 3 == 0 else None, roles=[ADMIN_ROLE_ID] if i == 0 else [])
+            self.member_ids.append(2000 + i)
+        self.admin_id = self.member_ids[0]
+
+        # The category hides its channels, statics show them to their members
+        world.channel_payload(GUILD_ID, 'statics', 4, channel_id=CATEGORY_ID, overwrites=[
+            { 'id': GUILD_ID, 'type': 'role', 'allow': 0, 'deny': VIEW_CHANNEL },
+        ])
+        self.statics = []
+        for i in range(args.statics):
+            members = self.random.sample(self.member_ids[1:], args.static_size)
+            data = world.channel_payload(GUILD_ID, f'static-bench{i}', 0, parent_id=CATEGORY_ID, overwrites=[
+                { 'id': GUILD_ID, 'type': 'role', 'allow': 0, 'deny': VIEW_CHANNEL },
+            ] + [
+                { 'id': member_id, 'type': 'member', 'allow': VIEW_CHANNEL, 'deny': 0 }
+                for member_id in members
+            ])
+            world.add_message(data['id'], world.bot_user, f'Welcome to your new group <@{members[0]}>!')
+
+            # Half of the channels don't tell their last message, as after a restart
+            if i % 2:
+                data['last_message_id'] = None
+            self.statics.append((int(data['id']), members))
+
+        self.guild = world.create_guild(GUILD_ID, [
+            (ADMIN_ROLE_ID, 'admin'), (BOTS_ROLE_ID, 'bots'),
+            (BLACKLIST_ROLE_ID, 'blacklist'), (ONE_CHANNEL_ROLE_ID, 'one-channel'),
+        ])
+
+    def tag(self, member_id):
+        # From the fake Discord: with --low-memory, the bot doesn't cache members
+        user = self.world.users[member_id]
+        return f"{user['username']}#{user['discriminator']}"
+
+    async def phase(self, name, messages, handler=None):
+        """Run the bot on every message (with some concurrency) and record the results.
+
+        handler is the bot's coroutine receiving the messages, on_message by default.
+        """
+        http = self.world.http
+        handler = handler or bot.on_message
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies = []
+
+        async def run(message):
+            async with semaphore:
+                start = time.perf_counter()
+                await handler(message)
+                latencies.append(time.perf_counter() - start)
+
+        messages = list(messages)
+        calls = http.total_calls
+        tracemalloc.reset_peak()
+
+        await asyncio.gather(*(run(message) for message in messages))
+        await asyncio.sleep(0) # let gateway events in
+
+        _, peak = tracemalloc.get_traced_memory()
+        self.results[name] = {
+            'commands': len(messages),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'rest_per_command': (http.total_calls - calls) / len(messages),
+            'peak_mb': peak / 2 ** 20,
+        }
+
+    def create_messages(self):
+        for i in range(self.args.commands):
+            author_id = self.member_ids[1 + i]
+            yield self.world.post(self.world.dm_channel(author_id), author_id, f'$create new{i}')
+
+    def add_messages(self):
+        for _ in range(self.args.commands):
+            channel_id, members = self.random.choice(self.statics)
+            names = ' '.join(self.tag(member_id) for member_id in self.random.sample(self.member_ids[1:], 3))
+            yield self.world.post(self.guild.get_channel(channel_id), members[0], f'$add {names}')
+
+    def slash_add_interactions(self):
+        for _ in range(self.args.commands):
+            channel_id, members = self.random.choice(self.statics)
+            options = [
+                (6, f'member{i + 1}', str(member_id))
+                for i, member_id in enumerate(self.random.sample(self.member_ids[1:], 3))
+            ]
+            yield self.world.interaction(self.guild.get_channel(channel_id), members[0], 'add', options)
+
+    def members_messages(self):
+        for _ in range(self.args.commands):
+            channel_id, members = self.random.choice(self.statics)
+            yield self.world.post(self.guild.get_channel(channel_id), members[0], '$members')
+
+    def last_message_messages(self):
+        for _ in range(max(1, self.args.commands // 20)):
+            yield self.world.post(self.world.dm_channel(self.admin_id), self.admin_id, '$last_message')
+
+    async def pin_messages(self):
+        messages = []
+        for _ in range(self.args.commands):
+            channel_id, members = self.random.choice(self.statics)
+            channel = self.guild.get_channel(channel_id)
+
+            # Something worth pinning, seen by the bot like any other message
+            await bot.on_message(self.world.post(channel, members[0], 'Raid on friday at 21:00'))
+            messages.append(self.world.post(channel, members[0], '$pin'))
+
+        return messages
+
+    async def run(self):
+        tracemalloc.start()
+
+        self.setup()
+        await bot.on_ready()
+        # Let the background indexing finish
+        while not (bot.guilds[GUILD_ID].member_names.ready or self.args.low_memory):
+            await asyncio.sleep(0)
+        setup_mb = tracemalloc.get_traced_memory()[0] / 2 ** 20
+
+        await self.phase('$create', self.create_messages())
+        await self.phase('$add', self.add_messages())
+        await self.phase('/add', self.slash_add_interactions(), handler=bot.on_interaction)
+        await self.phase('$members', self.members_messages())
+        await self.phase('$last_message', self.last_message_messages())
+        await self.phase('$pin', await self.pin_messages())
+
+        for task in bot.background_tasks:
+            task.cancel()
+        bot.registry.close()
+
+        return setup_mb
+
+
+def report(results, setup_mb, out=sys.stdout):
+    print(f'Memory after startup: {setup_mb:.1f} MB', file=out)
+    print(f"{'command':<15} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'REST/cmd':>9} {'peak MB':>9}", file=out)
+    for name, r in results.items():
+        print(
+            f"{name:<15} {r['commands']:>6} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+            f"{r['rest_per_command']:>9.2f} {r['peak_mb']:>9.1f}",
+            file=out
+        )
+
+
+def regressions(results, baseline, tolerance):
+    """List of the metrics that got worse than baseline * (1 + tolerance)."""
+    found = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+
+        for metric in ('p99_ms', 'rest_per_command', 'peak_mb'):
+            limit = baseline[name][metric] * (1 + tolerance)
+            if r[metric] > limit and r[metric] - baseline[name][metric] > 1e-6:
+                found.append(f'{name} {metric}: {r[metric]:.2f} > {limit:.2f}')
+
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000, help='members in the guild')
+    parser.add_argument('--statics', type=int, default=300, help='existing static channels')
+    parser.add_argument('--static-size', type=int, default=8, help='members per static')
+    parser.add_argument('--commands', type=int, default=200, help='commands per phase')
+    parser.add_argument('--concurrency', type=int, default=8, help='commands in flight')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per REST call')
+    parser.add_argument('--jitter', type=float, default=0.01, help='extra random seconds per REST call')
+    parser.add_argument('--low-memory', action='store_true', help='run the bot with LOW_MEMORY')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='fail if results regressed compared to this --json file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed regression (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    if args.commands >= args.members:
+        parser.error('--commands must be smaller than --members')
+
+    bench = Bench(args)
+    setup_mb = asyncio.run(bench.run())
+    report(bench.results, setup_mb)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({ 'setup_mb': setup_mb, 'commands': bench.results }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['commands']
+
+        found = regressions(bench.results, baseline, args.tolerance)
+        if found:
+            print('Regressions:\n' + '\n'.join(found), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,28 @@
 import os
 import sys
 import json
+import time
+import bisect
+import logging
+import datetime
+import asyncio
+import functools
+import collections
 
 import discord
 
+from registry import StaticRegistry
+from ratelimit import RateLimiter, Scheduler, Busy, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from metrics import Metrics, current_command
+from purge import Purger
+from snapshot import StateSnapshot
+from interactions import (
+    Interaction, slash_command, option, register_guild_commands, parse_message_id,
+    APPLICATION_COMMAND, STRING, INTEGER, BOOLEAN, USER,
+)
+
+log = logging.getLogger('static-bot')
+
 # These strings are used by the $help command
 DM_HELP = """
 Send me a DM with the following command:
@@ -36,6 +55,9 @@ Send me a DM with the following command:
 `$last_message` - lists all static channels in order of the last message date.
     If no message is present in the channel, its date is the date of creation of the channel.
 
+`$rebuild_registry` - registers the creators of statics that were created before the bot kept track of them.
+    The creator is taken from the first mention in the channel (the welcome message).
+
 Remember that there are other commands you can use inside your static groups. 
 Use $help there to see an explanation of them.
 """.strip()
@@ -47,6 +69,7 @@ For commands that ask you for usernames,
 use the discord username (i.e. DiscordLord#9999), 
 make sure that every character and number is correct
 and that you respect uppercase/lowercase.
+You can also use their nickname in the server (here uppercase/lowercase doesn't matter).
 
 `$add` - add members to this group. You can pass multiple people separating them by spaces.
     Example:
@@ -72,429 +95,2009 @@ and that you respect uppercase/lowercase.
 `$unpin` - unpin the replied message.
 
     **You must reply to the message you want to unpin** with $unpin for it to work.
+
+Most commands are also available as slash commands: type / to see them.
 """.strip()
 
-# Get bot token
-with open('token.txt') as f:
-    TOKEN = f.read().replace('\n', '').strip()
+# Optional configuration, can be overridden in conf.json
+# Commands accepted as $ messages, and as slash commands (registered in the guild on startup)
+TEXT_COMMANDS = True
+SLASH_COMMANDS = True
+# Seconds between reconciliations of the in-memory indexes with the gateway cache
+RECONCILE_INTERVAL = 15 * 60
+# Apply all the permission changes of $add/$remove in a single request
+BATCH_OVERWRITES = True
+# File where the creators of the statics are saved, and seconds between writes to it
+REGISTRY_PATH = 'statics.db'
+REGISTRY_FLUSH_INTERVAL = 5
+# File where the state derived from Discord is saved (to resume quickly after a restart, None to disable),
+# and seconds between writes to it (it is also written on shutdown)
+SNAPSHOT_PATH = None
+SNAPSHOT_INTERVAL = 5 * 60
+# Commands allowed per user as [count, seconds], over all commands and for each command (null to disable)
+USER_RATE_LIMIT = [10, 60]
+COMMAND_RATE_LIMIT = [3, 10]
+# Commands run concurrently, and commands that can wait before the bot refuses new ones
+SCHEDULER_WORKERS = 4
+SCHEDULER_MAX_PENDING = 50
+# Don't cache every member of the guild, only the ones the bot uses (up to MEMBER_CACHE_SIZE)
+LOW_MEMORY = False
+MEMBER_CACHE_SIZE = 1000
+# Last messages kept in memory per static channel, so that $pin/$unpin don't need to fetch them
+MESSAGE_CACHE_SIZE = 20
+# Channels cleared ($clear) at the same time, and seconds between progress reports of a clear
+PURGE_MAX_JOBS = 3
+PURGE_REPORT_INTERVAL = 10
+# Metrics: served in the Prometheus format at http://METRICS_HOST:METRICS_PORT/metrics,
+# and/or logged every METRICS_LOG_INTERVAL seconds. Not collected if both are null.
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+METRICS_LOG_INTERVAL = None
+
+# Statics without messages for IDLE_STATIC_DAYS are archived (moved to the ARCHIVE_CATEGORY_ID of their
+# guild) or deleted (if it has none), checking every IDLE_CHECK_INTERVAL seconds. null disables it.
+IDLE_STATIC_DAYS = None
+IDLE_CHECK_INTERVAL = 6 * 60 * 60
+# Idle statics archived/deleted at a time, and seconds between batches
+IDLE_BATCH_SIZE = 5
+IDLE_BATCH_DELAY = 10
+# A client with several shards (AutoShardedClient), for bots in many guilds
+SHARDED = False
+# Seconds between checks of conf.json for changes (the guild settings are reloaded without a restart)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Created by create_app
+CONF_PATH = None # conf.json, to reload it
+client = None
+registry = None # static channel id -> creator, persisted
+snapshot = None # None when disabled
+user_limiter = None # rate limiters (user id, and (user id, command))
+command_limiter = None
+scheduler = None # commands run in it
+purger = None # runs the $clear jobs
+metrics = None # None when disabled
+
+# Event handlers, registered on the client by create_app
+EVENTS = []
+
+
+def event(handler):
+    EVENTS.append(handler)
+    return handler
+
+
+class NameIndex:
+    """Name -> object index (channels, roles) kept up to date from gateway events.
+
+    Names are matched case-insensitively. If several objects share a name,
+    the last one added wins.
+    """
+
+    def __init__(self):
+        self._by_name = {}
+        self._names = {} # id -> indexed name, to find stale entries on rename
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    @staticmethod
+    def key(name):
+        return name.lower().strip()
+
+    def get(self, name):
+        return self._by_name.get(self.key(name))
+
+    def add(self, item):
+        self.remove(item)
+
+        name = self.key(item.name)
+        self._by_name[name] = item
+        self._names[item.id] = name
+
+    def remove(self, item):
+        name = self._names.pop(item.id, None)
+        if name is not None and self._by_name.get(name) is not None and self._by_name[name].id == item.id:
+            del self._by_name[name]
+
+    def rebuild(self, items):
+        self._by_name.clear()
+        self._names.clear()
+
+        for item in items:
+            self.add(item)
+
+
+class MemberNameIndex:
+    """Member lookup by NAME#XXXX, username or (case-insensitive) nickname.
+
+    Kept up to date from member events. Also supports prefix lookups,
+    used to suggest names when one is not found.
+    """
+
+    # Members indexed per step while building, before yielding to the event loop
+    BUILD_BATCH = 1000
+
+    def __init__(self):
+        self.ready = False # built after the member chunk, get_member_named is used until then
+
+        self._tags = {} # 'name#1234' -> member id
+        self._names = {} # username -> member ids
+        self._nicks = {} # casefolded nickname -> member ids
+        self._keys = {} # member id -> (tag, name, nick) it is indexed under
+        self._sorted = None # sorted (casefolded key, display name) for prefix lookups, rebuilt lazily
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, member):
+        self.remove(member)
+
+        tag = f'{member.name}#{member.discriminator}'
+        nick = member.nick.casefold() if member.nick else None
+
+        self._tags[tag] = member.id
+        self._names.setdefault(member.name, set()).add(member.id)
+        if nick is not None:
+            self._nicks.setdefault(nick, set()).add(member.id)
+
+        self._keys[member.id] = (tag, member.name, nick)
+        self._sorted = None
+
+    def remove(self, member):
+        keys = self._keys.pop(member.id, None)
+        if keys is None:
+            return
+
+        tag, name, nick = keys
+        if self._tags.get(tag) == member.id:
+            del self._tags[tag]
+        for index, key in ((self._names, name), (self._nicks, nick)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(member.id)
+                if not ids:
+                    del index[key]
+
+        self._sorted = None
+
+    async def build(self, members):
+        self.ready = False
+
+        self._tags.clear()
+        self._names.clear()
+        self._nicks.clear()
+        self._keys.clear()
+
+        members = list(members)
+        for i in range(0, len(members), self.BUILD_BATCH):
+            for member in members[i:i + self.BUILD_BATCH]:
+                self.add(member)
+            await asyncio.sleep(0)
+
+        self.ready = True
+
+    def lookup(self, name):
+        """Id of the member called name (NAME#XXXX, username or nickname), or None."""
+        if len(name) > 5 and name[-5] == '#':
+            member_id = self._tags.get(name)
+            if member_id is not None:
+                return member_id
+
+        for ids in (self._names.get(name), self._nicks.get(name.casefold())):
+            if ids:
+                return next(iter(ids))
+
+        return None
+
+    def suggest(self, prefix, limit=3):
+        """Up to limit NAME#XXXX whose tag or nickname start with prefix (case-insensitive)."""
+        if self._sorted is None:
+            self._sorted = sorted(
+                [ (tag.casefold(), tag) for tag in self._tags ] +
+                [ (nick, tag) for tag, _, nick in self._keys.values() if nick is not None ]
+            )
+
+        prefix = prefix.split('#')[0].casefold()
+        suggestions = []
+        i = bisect.bisect_left(self._sorted, (prefix, ''))
+        while i < len(self._sorted) and len(suggestions) < limit and self._sorted[i][0].startswith(prefix):
+            if self._sorted[i][1] not in suggestions:
+                suggestions.append(self._sorted[i][1])
+            i += 1
+
+        return suggestions
+
+
+class MemberCache:
+    """Bounded LRU of members, for the LOW_MEMORY mode."""
+
+    def __init__(self, size):
+        self.size = size
+        self._members = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._members)
+
+    def get(self, member_id):
+        member = self._members.get(member_id)
+        if member is not None:
+            self._members.move_to_end(member_id)
+
+        return member
+
+    def put(self, member):
+        self._members[member.id] = member
+        self._members.move_to_end(member.id)
+
+        while len(self._members) > self.size:
+            self._members.popitem(last=False)
+
+    def discard(self, member_id):
+        self._members.pop(member_id, None)
+
+    def clear(self):
+        self._members.clear()
+
+
+class RecentMessages:
+    """The last messages received in each static channel (up to size per channel).
+
+    Messages are cached in arrival order, so the message before a cached one
+    is known if it is cached too.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._channels = {} # channel id -> OrderedDict of message id -> message
+        self._own_pin_updates = collections.Counter() # channel id -> pin updates caused by the bot
+
+    def add(self, message):
+        messages = self._channels.get(message.channel.id)
+        if messages is None:
+            messages = self._channels[message.channel.id] = collections.OrderedDict()
+
+        messages[message.id] = message
+        while len(messages) > self.size:
+            messages.popitem(last=False)
+
+    def get(self, channel_id, message_id):
+        return self._channels.get(channel_id, {}).get(message_id)
+
+    def previous(self, message):
+        """The message sent right before message, or None if unknown."""
+        messages = self._channels.get(message.channel.id)
+        if messages is None or message.id not in messages:
+            return None
+
+        previous = None
+        for message_id, cached in messages.items():
+            if message_id == message.id:
+                return previous
+            previous = cached
+
+    def last(self, channel_id):
+        """The last message received in a channel, or None if unknown."""
+        messages = self._channels.get(channel_id)
+        return next(reversed(messages.values())) if messages else None
+
+    def remove(self, channel_id, message_ids):
+        messages = self._channels.get(channel_id)
+        if messages is not None:
+            for message_id in message_ids:
+                messages.pop(message_id, None)
+
+    def drop_channel(self, channel_id):
+        self._channels.pop(channel_id, None)
+        self._own_pin_updates.pop(channel_id, None)
+
+    def clear(self):
+        self._channels.clear()
+        self._own_pin_updates.clear()
+
+    def expect_pin_update(self, channel_id):
+        self._own_pin_updates[channel_id] += 1
+
+    def pin_update_failed(self, channel_id):
+        # The expected update may never come, or the pin may have happened anyway: start over
+        self.drop_channel(channel_id)
+
+    def pins_updated(self, channel_id):
+        # Someone else (un)pinned a message: the pinned flags of the cache can't be trusted anymore
+        if self._own_pin_updates[channel_id] > 0:
+            self._own_pin_updates[channel_id] -= 1
+        else:
+            self.drop_channel(channel_id)
+
+
+# Per-guild settings of conf.json (either top-level, or one object per guild in "GUILDS")
+GUILD_KEYS = (
+    'GUILD_ID', 'CATEGORY_ID', 'ADMIN_ROLE_ID', 'BOTS_ROLE_ID',
+    'BLACKLIST_ROLE_ID', 'WHITELIST_ROLE_ID', 'ONE_CHANNEL_ROLE_ID',
+    'ARCHIVE_CATEGORY_ID', 'ADMIN_CHANNEL_ID',
+)
+
+
+class StaticGuild:
+    """A guild served by the bot: its settings, and the indexes of its statics and members."""
+
+    def __init__(self, conf):
+        self.conf = { k: conf.get(k) for k in GUILD_KEYS }
 
-# Get configuration variables
-conf = sys.argv[1]
-with open(conf) as f:
-    conf = json.load(f)
+        self.id = conf.get('GUILD_ID')
+        self.category_id = conf.get('CATEGORY_ID')
+        self.admin_role_id = conf.get('ADMIN_ROLE_ID')
+        self.bots_role_id = conf.get('BOTS_ROLE_ID')
+        self.blacklist_role_id = conf.get('BLACKLIST_ROLE_ID')
+        self.whitelist_role_id = conf.get('WHITELIST_ROLE_ID')
+        self.one_channel_role_id = conf.get('ONE_CHANNEL_ROLE_ID')
+        # Where idle statics are moved (deleted if None), and where admins get reports
+        self.archive_category_id = conf.get('ARCHIVE_CATEGORY_ID')
+        self.admin_channel_id = conf.get('ADMIN_CHANNEL_ID')
 
-for k, v in conf.items():
-    globals()[k] = v
+        # Check that required roles are configured
+        assert not any(idx is None for idx in (self.id, self.category_id, self.admin_role_id, self.blacklist_role_id))
 
-# Check that required roles are configured
-assert not any(idx is None for idx in (GUILD_ID, CATEGORY_ID, ADMIN_ROLE_ID, BLACKLIST_ROLE_ID))
+        # Static channels (by name) and guild roles (by name)
+        self.channels = NameIndex()
+        self.roles = NameIndex()
+        # Guild members by name
+        self.member_names = MemberNameIndex()
+        # Member id -> frozenset of its role ids, computed lazily and refreshed on member updates
+        self.member_role_ids = {}
+        # Members used recently, when the guild member cache is disabled (LOW_MEMORY)
+        self.member_cache = MemberCache(MEMBER_CACHE_SIZE)
+        # Ids of users Discord said are not members (oldest first, up to MEMBER_CACHE_SIZE), until they join
+        self.non_members = collections.OrderedDict()
 
-# Create client
-# The members intent is required for some functionalities
-intents = discord.Intents.default()
-intents.members = True
 
-client = discord.Client(intents=intents)
+def load_guilds(conf):
+    """Guild id -> StaticGuild, from the contents of conf.json."""
+    return { guild.id: guild for guild in map(StaticGuild, conf.get('GUILDS') or [ conf ]) }
 
-    
-@client.event
+
+# Guilds served by the bot, by id
+guilds = {}
+
+# Static channel id -> datetime of its last message (creation date if it has none).
+# Channels missing here are unknown and need a history fetch.
+last_activity = {}
+
+# Max concurrent history fetches for channels with unknown activity
+HISTORY_CONCURRENCY = 5
+
+# Static channel id -> ids of its members (non-bot members with a view_channel overwrite)
+static_members = {}
+
+# Static channel id -> command ('$members' or '$mention') -> the messages it replies with.
+# Dropped when the members of the channel or their names change
+# (and on every rebuild of the indexes, for member events missed with LOW_MEMORY).
+member_lists = {}
+
+# Max length of a Discord message
+MESSAGE_LIMIT = 2000
+
+# Static channel id -> lock held while its overwrites are read and written back (batched $add/$remove)
+overwrite_locks = {}
+
+# Max concurrent member fetches when LOW_MEMORY
+FETCH_CONCURRENCY = 5
+
+# Last messages of each static channel
+recent_messages = RecentMessages(MESSAGE_CACHE_SIZE)
+
+background_tasks = []
+
+
+def is_static_channel(channel):
+    if not isinstance(channel, discord.TextChannel):
+        return False
+
+    config = guilds.get(channel.guild.id)
+    return config is not None and channel.category_id == config.category_id
+
+
+def touch_activity(channel_id, when):
+    if when is not None and (channel_id not in last_activity or last_activity[channel_id] < when):
+        last_activity[channel_id] = when
+
+
+def seed_activity(channel):
+    # The id of the last message is a snowflake, which already contains its timestamp
+    if channel.last_message_id is not None:
+        touch_activity(channel.id, discord.utils.snowflake_time(channel.last_message_id))
+
+
+def role_ids(member):
+    config = guilds.get(member.guild.id)
+    if config is None:
+        return frozenset(role.id for role in member.roles)
+    if LOW_MEMORY:
+        # Member updates are not received for members outside of the cache (all of them),
+        # so only the roles of the member object itself can be trusted
+        return frozenset(member._roles)
+
+    ids = config.member_role_ids.get(member.id)
+    if ids is None:
+        ids = config.member_role_ids[member.id] = frozenset(role.id for role in member.roles)
+
+    return ids
+
+
+def is_static_member(channel, member):
+    return member.id in static_members.get(channel.id, ())
+
+
+def index_static_members(channel):
+    # Members missing from the cache are included too (as discord.Object).
+    # Their roles are unknown, so bots among them are filtered by get_static_members.
+    bots_role_id = guilds[channel.guild.id].bots_role_id
+    members = {
+        target_id
+        for target_id, (target, overwrite) in overwrites_by_id(channel).items()
+        if not isinstance(target, discord.Role) and overwrite.view_channel and
+        not (isinstance(target, discord.Member) and bots_role_id in role_ids(target))
+    }
+    if static_members.get(channel.id) != members:
+        member_lists.pop(channel.id, None)
+    static_members[channel.id] = members
+
+
+def forget_member_lists(member_id):
+    """Drop the rendered member lists of the statics of a member (its name or membership changed)."""
+    for channel_id, members in static_members.items():
+        if member_id in members:
+            member_lists.pop(channel_id, None)
+
+
+def get_cached_member(guild, member_id):
+    member = guild.get_member(member_id)
+    if member is None:
+        member = guilds[guild.id].member_cache.get(member_id)
+
+    return member
+
+
+async def fetch_member(guild, member_id, refresh=False):
+    """Member of guild with member_id, or None.
+
+    Asks Discord for members not cached when LOW_MEMORY, or while the guild member chunk is incomplete.
+    With refresh and LOW_MEMORY, the member is always asked for: the member cache may have outdated roles.
+    """
+    config = guilds[guild.id]
+    if member_id in config.non_members:
+        return None
+
+    member = get_cached_member(guild, member_id) if not (refresh and LOW_MEMORY) else None
+    if member is None and (LOW_MEMORY or not guild.chunked):
+        try:
+            member = await guild.fetch_member(member_id)
+        except discord.NotFound:
+            # Don't ask again on each of their commands
+            config.non_members[member_id] = True
+            while len(config.non_members) > MEMBER_CACHE_SIZE:
+                config.non_members.popitem(last=False)
+            return None
+
+        config.member_cache.put(member)
+
+    return member
+
+
+def index_guild(config, guild, keep_members=False):
+    """Index the statics and roles of guild from the gateway cache. Returns whether the category was found.
+
+    With keep_members, statics that already have members indexed (e.g. from the snapshot) keep them.
+    """
+    category = guild.get_channel(config.category_id)
+    config.channels.rebuild(category.text_channels if category is not None else ())
+    config.roles.rebuild(guild.roles)
+
+    config.member_role_ids.clear()
+    # Member events are not received for members outside of the cache, so refresh them
+    config.member_cache.clear()
+    config.non_members.clear()
+
+    for channel in config.channels:
+        seed_activity(channel)
+        if not (keep_members and channel.id in static_members):
+            index_static_members(channel)
+
+    return category is not None
+
+
+def rebuild_indexes():
+    member_lists.clear()
+
+    ids = set()
+    complete = {} # guild id -> ids of its statics, for the guilds whose category was found
+    for config in guilds.values():
+        guild = client.get_guild(config.id)
+        if guild is None:
+            continue
+
+        found = index_guild(config, guild)
+        channel_ids = { channel.id for channel in config.channels }
+        ids.update(channel_ids)
+        if found:
+            complete[guild.id] = channel_ids
+
+    for channel_id in set(last_activity) - ids:
+        del last_activity[channel_id]
+    for channel_id in set(static_members) - ids:
+        del static_members[channel_id]
+
+    # Only the statics of fully indexed guilds are known to be gone: the registry keeps
+    # those of guilds not served right now (e.g. removed from conf.json by mistake)
+    for entry in list(registry):
+        guild_id = entry.guild_id
+        if guild_id is None:
+            # Registered before guilds were recorded: only known once its channel is found
+            guild_id = next((guild_id for guild_id, channel_ids in complete.items() if entry.channel_id in channel_ids), None)
+            if guild_id is not None:
+                registry.add(entry.channel_id, entry.creator_id, entry.created_at, guild_id)
+        elif guild_id in complete and entry.channel_id not in complete[guild_id]:
+            registry.remove(entry.channel_id)
+
+
+def parse_guild_create(parse, data):
+    # Gateway parser: index the guild as soon as it is received, so that commands are served
+    # without waiting for its member chunk (on_ready rebuilds the indexes once it is complete)
+    parse(data)
+
+    config = guilds.get(int(data['id']))
+    guild = client.get_guild(config.id) if config is not None else None
+    if guild is not None:
+        index_guild(config, guild, keep_members=True)
+
+
+def snapshot_state():
+    """Static channel id -> (member ids, last activity), for the snapshot (copied, it is saved in a thread)."""
+    return {
+        channel_id: (set(static_members.get(channel_id, ())), last_activity.get(channel_id))
+        for channel_id in static_members.keys() | last_activity.keys()
+    }
+
+
+def restore_snapshot(state):
+    for channel_id, (members, when) in state.items():
+        static_members[channel_id] = members
+        touch_activity(channel_id, when)
+
+
+def build_member_names(config):
+    # Only once the member cache is complete (after on_ready), and unless LOW_MEMORY
+    # (where names are queried to Discord instead)
+    guild = client.get_guild(config.id)
+    if guild is not None and not LOW_MEMORY:
+        background_tasks.append(client.loop.create_task(config.member_names.build(guild.members)))
+
+
+def apply_guilds(new):
+    """Serve the guilds of new (id -> StaticGuild), keeping the indexes of the ones that didn't change."""
+    changed = [ guild_id for guild_id, config in new.items() if guild_id not in guilds or guilds[guild_id].conf != config.conf ]
+    for guild_id in new.keys() - changed:
+        new[guild_id] = guilds[guild_id]
+
+    guilds.clear()
+    guilds.update(new)
+    rebuild_indexes()
+
+    for guild_id in changed:
+        build_member_names(guilds[guild_id])
+    if SLASH_COMMANDS and changed:
+        background_tasks.append(client.loop.create_task(register_app_commands(changed)))
+
+    log.info('Serving %d guilds (%d new or changed)', len(guilds), len(changed))
+
+
+async def watch_config(path, interval):
+    """Apply the guilds of the configuration file whenever it changes, without a restart."""
+    mtime = os.path.getmtime(path)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if os.path.getmtime(path) == mtime:
+                continue
+
+            mtime = os.path.getmtime(path)
+            with open(path) as f:
+                new = load_guilds(json.load(f))
+        except Exception:
+            log.warning('Could not reload %s, keeping the current configuration', path, exc_info=True)
+            continue
+
+        apply_guilds(new)
+
+
+async def reconcile_indexes():
+    # Events can be missed (e.g. during reconnections), so periodically
+    # rebuild the indexes from the gateway cache to fix any drift.
+    while not client.is_closed():
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        rebuild_indexes()
+
+
+@event
 async def on_ready():
     await client.change_presence()
-    print('We have logged in as {0.user}'.format(client))
+
+    # Messages may have been missed while disconnected
+    recent_messages.clear()
+
+    rebuild_indexes()
+    if not background_tasks:
+        background_tasks.append(client.loop.create_task(reconcile_indexes()))
+        background_tasks.append(client.loop.create_task(registry.run(REGISTRY_FLUSH_INTERVAL)))
+        if snapshot is not None:
+            background_tasks.append(client.loop.create_task(snapshot.run(SNAPSHOT_INTERVAL, snapshot_state)))
+        if SLASH_COMMANDS:
+            background_tasks.append(client.loop.create_task(register_app_commands(list(guilds))))
+        if IDLE_STATIC_DAYS:
+            background_tasks.append(client.loop.create_task(archive_idle_statics()))
+        if CONF_PATH is not None and CONFIG_RELOAD_INTERVAL:
+            background_tasks.append(client.loop.create_task(watch_config(CONF_PATH, CONFIG_RELOAD_INTERVAL)))
+
+        if metrics is not None:
+            background_tasks.append(client.loop.create_task(metrics.measure_loop_lag()))
+            if METRICS_LOG_INTERVAL:
+                background_tasks.append(client.loop.create_task(metrics.log_periodically(log, METRICS_LOG_INTERVAL)))
+            if METRICS_PORT:
+                await metrics.serve(METRICS_HOST, METRICS_PORT)
+                log.info('Serving metrics on http://%s:%s/metrics', METRICS_HOST, METRICS_PORT)
+
+    # on_ready comes after the member chunk, so the member cache is complete
+    for config in guilds.values():
+        build_member_names(config)
+
+    log.info('We have logged in as %s', client.user)
     # The bot will receive messages after printing this
 
-@client.event
+
+@event
+async def on_guild_channel_create(channel):
+    if is_static_channel(channel):
+        guilds[channel.guild.id].channels.add(channel)
+        touch_activity(channel.id, channel.created_at)
+        index_static_members(channel)
+
+
+@event
+async def on_guild_channel_delete(channel):
+    config = guilds.get(channel.guild.id)
+    if config is not None:
+        config.channels.remove(channel)
+    last_activity.pop(channel.id, None)
+    static_members.pop(channel.id, None)
+    member_lists.pop(channel.id, None)
+    overwrite_locks.pop(channel.id, None)
+    registry.remove(channel.id)
+    recent_messages.drop_channel(channel.id)
+    purger.cancel(channel.id)
+
+
+@event
+async def on_raw_message_delete(payload):
+    recent_messages.remove(payload.channel_id, (payload.message_id,))
+
+
+@event
+async def on_raw_bulk_message_delete(payload):
+    recent_messages.remove(payload.channel_id, payload.message_ids)
+
+
+@event
+async def on_guild_channel_pins_update(channel, last_pin):
+    recent_messages.pins_updated(channel.id)
+
+
+@event
+async def on_guild_channel_update(before, after):
+    # Covers renames and channels moved in or out of the category
+    config = guilds.get(after.guild.id)
+    if config is None:
+        return
+
+    config.channels.remove(before)
+    if is_static_channel(after):
+        config.channels.add(after)
+        seed_activity(after)
+        index_static_members(after)
+    else:
+        last_activity.pop(after.id, None)
+        static_members.pop(after.id, None)
+        member_lists.pop(after.id, None)
+
+
+@event
+async def on_member_join(member):
+    config = guilds.get(member.guild.id)
+    if config is not None:
+        config.non_members.pop(member.id, None)
+    if config is not None and config.member_names.ready:
+        config.member_names.add(member)
+    # Back in the statics that kept their overwrite
+    forget_member_lists(member.id)
+
+
+@event
+async def on_user_update(before, after):
+    # Username or discriminator changed
+    for config in guilds.values():
+        guild = client.get_guild(config.id)
+        member = guild.get_member(after.id) if guild is not None else None
+        if member is not None and config.member_names.ready:
+            config.member_names.add(member)
+    forget_member_lists(after.id)
+
+
+@event
+async def on_member_update(before, after):
+    config = guilds.get(after.guild.id)
+    if config is None:
+        return
+
+    if before.nick != after.nick:
+        if config.member_names.ready:
+            config.member_names.add(after)
+        forget_member_lists(after.id)
+    if before.roles == after.roles:
+        return
+
+    was_bot = config.bots_role_id in role_ids(before)
+    config.member_role_ids[after.id] = frozenset(role.id for role in after.roles)
+    is_bot = config.bots_role_id in role_ids(after)
+
+    # Bots are not counted as static members
+    if was_bot != is_bot:
+        for channel in config.channels:
+            members = static_members.setdefault(channel.id, set())
+            if is_bot and after.id in members:
+                members.discard(after.id)
+            elif not is_bot and channel.overwrites_for(after).view_channel:
+                members.add(after.id)
+            else:
+                continue
+
+            member_lists.pop(channel.id, None)
+
+
+@event
+async def on_member_remove(member):
+    config = guilds.get(member.guild.id)
+    if config is None:
+        return
+
+    config.member_role_ids.pop(member.id, None)
+    config.member_names.remove(member)
+    config.member_cache.discard(member.id)
+    forget_member_lists(member.id)
+
+
+@event
+async def on_guild_role_create(role):
+    config = guilds.get(role.guild.id)
+    if config is not None:
+        config.roles.add(role)
+
+
+@event
+async def on_guild_role_delete(role):
+    config = guilds.get(role.guild.id)
+    if config is not None:
+        config.roles.remove(role)
+
+
+@event
+async def on_guild_role_update(before, after):
+    config = guilds.get(after.guild.id)
+    if config is not None:
+        config.roles.add(after)
+
+
+# Contexts a command can be sent from
+DM = 'dm'
+STATIC = 'static'
+
+# Command table, keyed by (context, command name)
+COMMANDS = {}
+# Slash command name -> key of its command in COMMANDS
+APP_COMMANDS = {}
+
+
+class Command:
+
+    def __init__(self, handler, admin=False, member=True, priority=None, slash=None, defer=False, merge=True):
+        self.handler = handler
+        # Only admins can use this command (silently ignored otherwise)
+        self.admin = admin
+        # The author must be a non-blacklisted (and whitelisted) member of the guild.
+        # Admin commands always require it.
+        self.member = member or admin
+        # Scheduler priority. Admin commands go first by default.
+        if priority is None:
+            priority = PRIORITY_HIGH if admin else PRIORITY_NORMAL
+        self.priority = priority
+        # Registration data of its slash command (see interactions.slash_command), if it has one
+        self.slash = slash
+        # Slow command: as a slash command, acknowledge it before running it
+        self.defer = defer
+        # Identical pending commands in a channel can run once. Not for commands that
+        # depend on where they are sent (e.g. $pin pins the message before it).
+        self.merge = merge
+
+
+def command(context, name, admin=False, member=True, priority=None, slash=None, defer=False, merge=True):
+    """Register the decorated coroutine as the handler of `name` in `context`.
+
+    With slash, it is also available as the slash command /name (without the $).
+    """
+    def decorator(handler):
+        COMMANDS[(context, name)] = Command(
+            handler, admin=admin, member=member, priority=priority, slash=slash, defer=defer, merge=merge
+        )
+        if slash is not None:
+            APP_COMMANDS[name.lstrip('$')] = (context, name)
+        return handler
+
+    return decorator
+
+
+class Context:
+    """Everything a command handler needs to know about the command it answers."""
+
+    def __init__(self, channel, author, command, args, message=None, reference=None, targets=None):
+        self.message = message # None for slash commands
+        self.channel = channel
+        self.author = author
+        self.command = command
+        self.args = args
+        self.author_id = f'{author.name} ({author.id})'
+        # Settings of the guild the command is about (for DMs, found by resolve_member)
+        guild = getattr(channel, 'guild', None)
+        self.config = guilds.get(guild.id) if guild is not None else None
+        # Message the command refers to (the replied message), if any
+        self.reference = reference
+        # Members given as options of a slash command, instead of names in args
+        self.targets = targets
+
+        # Filled by resolve_member, only for commands that need them
+        self.guild = None
+        self.category = None
+        self.member = None
+
+    async def reply(self, content, reference=None):
+        return await self.channel.send(content, reference=reference)
+
+    async def denied(self):
+        """The author can't run the command. $ commands are ignored silently."""
+
+
+class InteractionContext(Context):
+    """Context of a slash command: replies are responses to its interaction."""
+
+    def __init__(self, interaction, channel, author, command, args, reference=None, targets=None):
+        super().__init__(channel, author, command, args, reference=reference, targets=targets)
+        self.interaction = interaction
+
+    async def reply(self, content, reference=None):
+        return await self.interaction.send(content)
+
+    async def denied(self):
+        await self.reply("Only admins can use this command.")
+
+
+def get_context(channel):
+    """Return the context of a channel (DM or STATIC), or None if the bot should ignore it."""
+    if channel.type == discord.ChannelType.private:
+        return DM
+
+    guild = getattr(channel, 'guild', None)
+    config = guilds.get(guild.id) if guild is not None else None
+    if config is not None and getattr(channel, 'category_id', None) == config.category_id:
+        return STATIC
+
+    return None # public channel
+
+
+def parse_command(content):
+    splits = content.split()
+    command, args = (splits[0], splits[1:]) if splits else ('', [])
+
+    return command.lower(), args
+
+
+async def check_rate_limits(ctx):
+    """Whether the author can run the command now. If not, they are warned (once)."""
+    author_id = ctx.author.id
+    for limiter, key in ((user_limiter, author_id), (command_limiter, (author_id, ctx.command))):
+        if limiter is not None and not limiter.consume(key):
+            if limiter.warn(key):
+                await error_message(ctx, "You are sending commands too fast. Wait a few seconds and try again.")
+            return False
+
+    return True
+
+
+async def shared_guilds(user):
+    """(settings, member) of the guilds served by the bot that user is a member of.
+
+    Members are up to date (see fetch_member), and asked for a few guilds at a time.
+    """
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def fetch(config):
+        guild = client.get_guild(config.id)
+        if guild is None:
+            return None
+
+        async with semaphore:
+            return await fetch_member(guild, user.id, refresh=True)
+
+    configs = list(guilds.values())
+    members = await asyncio.gather(*(fetch(config) for config in configs))
+    return [ (config, member) for config, member in zip(configs, members) if member is not None ]
+
+
+async def resolve_member(ctx):
+    """Resolve guild, category and member for ctx, checking blacklist/whitelist roles.
+
+    Returns False (after warning the author) if the command must not run.
+    """
+    member = None
+    if ctx.config is None:
+        # DM: the guild is the one the author shares with the bot
+        shared = await shared_guilds(ctx.author)
+        if len(shared) > 1:
+            await error_message(ctx, "You are in several servers I work for. Use my slash commands in the server you want instead.")
+            return False
+        ctx.config, member = shared[0] if shared else (None, None)
+
+    config = ctx.config
+    guild = client.get_guild(config.id) if config is not None else None
+    if config is None or guild is None:
+        await ctx.reply("Discord tells me you're not in the server. If this is not the case, contact an @admin.")
+        return False
+
+    category = guild.get_channel(config.category_id)
+    if category is None:
+        await error_message(ctx, "Guild/category was not found. Contact an admin.")
+        return False
+
+    author = ctx.author
+    if member is not None:
+        pass # found by shared_guilds
+    elif isinstance(author, discord.Member) and author.guild.id == guild.id:
+        member = author
+        if LOW_MEMORY:
+            config.member_cache.put(member)
+    else:
+        # Its roles decide whether the command can run: they must be up to date
+        member = await fetch_member(guild, author.id, refresh=True)
+
+    if member is None:
+        await ctx.reply("Discord tells me you're not in the server. If this is not the case, contact an @admin.")
+        return False
+    elif has_role(member, config.blacklist_role_id):
+        await error_message(ctx, "You are blacklisted from using this bot.")
+        return False
+    elif config.whitelist_role_id is not None and not has_role(member, config.whitelist_role_id):
+        await error_message(ctx, "You are not whitelisted to use this bot.")
+        return False
+
+    ctx.guild, ctx.category, ctx.member = guild, category, member
+    return True
+
+
+@event
 async def on_message(message):
+    context = get_context(message.channel)
+    if context == STATIC:
+        touch_activity(message.channel.id, message.created_at)
+        recent_messages.add(message)
+
+    # Ignore non-command messages and own messages
+    if not TEXT_COMMANDS or not message.content.startswith('$') or message.author == client.user:
+        return
+
+    # Drop public channels and unknown commands before any guild/member lookup
+    if context is None:
+        return
+
+    command, args = parse_command(message.content)
+    entry = COMMANDS.get((context, command))
+    if entry is None:
+        return
+
+    ctx = Context(message.channel, message.author, command, args, message=message, reference=message.reference)
+    await dispatch(context, entry, ctx)
+
+
+async def dispatch(context, entry, ctx):
+    """Check that the author can run the command of ctx, and run it in the scheduler."""
+    command = ctx.command
+    start = time.perf_counter() if metrics is not None else None
+    # So that the REST requests of the checks and error messages are counted for this command
+    # (the scheduler runs it in another task, see run_command)
+    token = current_command.set(command)
     try:
-        # Ignore non-command messages
-        if not message.content.startswith('$'): 
+        if not await check_rate_limits(ctx):
+            if metrics is not None:
+                metrics.error(command, 'RateLimited')
             return
-        elif '\n' in message.content:
-            await error_message(message.channel, "Can't use multiline messages when using commands.")
+        elif ctx.message is not None and '\n' in ctx.message.content:
+            await error_message(ctx, "Can't use multiline messages when using commands.")
             return
 
-        # Ignore own messages
-        if message.author == client.user:
+        if entry.member and not await resolve_member(ctx):
+            return
+        elif entry.admin and not is_admin(ctx.member):
+            await ctx.denied()
             return
 
+        # Identical commands in the same channel (replying to the same message) that are still pending
+        # run only once (but every slash command needs its own response)
+        key = None
+        if entry.merge and ctx.message is not None:
+            reference_id = ctx.reference.message_id if ctx.reference is not None else None
+            key = (context, command, ctx.channel.id, tuple(ctx.args), reference_id)
+        await scheduler.submit(entry.priority, lambda: run_command(entry, ctx), key=key)
+
+    except Busy:
+        count_error(command, 'Busy')
+        await error_message(ctx, "I'm a bit busy right now. Please try again in a few seconds.")
+    except discord.Forbidden:
+        count_error(command, 'Forbidden')
+        await error_message(ctx, "Bot doesn't have the permissions required for this action (@admin).")
+    except discord.HTTPException as e:
+        count_error(command, f'HTTPException {e.status}')
+        log.warning('Command %s failed', command, exc_info=True)
+        await error_message(ctx, "Something unexpected happened. Please try again in a few minutes.")
+    except Exception as e:
+        count_error(command, type(e).__name__)
+        raise
+    finally:
+        current_command.reset(token)
+        if start is not None:
+            metrics.observe_command(command, time.perf_counter() - start)
+
+
+def count_error(command, name):
+    if metrics is not None:
+        metrics.error(command, name)
+
+
+def parse_interaction_create(data):
+    # Gateway parser (discord.py 1.7 doesn't know interactions): handle them in a task
+    client.loop.create_task(on_interaction(data))
+
+
+def interaction_member(guild, user_id, resolved):
+    """Member from the resolved data of an interaction (or the cache), or None if not in the guild."""
+    member = guild.get_member(int(user_id))
+    if member is None and user_id in resolved.get('members', {}):
+        data = dict(resolved['members'][user_id], user=resolved['users'][user_id])
+        member = discord.Member(data=data, guild=guild, state=client._connection)
+
+    return member
+
+
+async def on_interaction(data):
+    # Not run by discord.py (see parse_interaction_create), so errors are handled here
+    interaction = Interaction(client.http, data, ephemeral=True)
+    try:
+        await run_interaction(interaction, data)
+    except Exception:
+        log.exception('Slash command %s failed', data.get('data', {}).get('name'))
+        # Otherwise Discord shows that the interaction failed, without any reason
+        if not interaction.responded:
+            try:
+                await interaction.send("Something unexpected happened. Please try again in a few minutes.")
+            except discord.HTTPException:
+                pass
+
+
+async def run_interaction(interaction, data):
+    if data.get('type') != APPLICATION_COMMAND or int(data.get('guild_id') or 0) not in guilds:
+        return
+
+    key = APP_COMMANDS.get(data['data']['name'])
+    guild = client.get_guild(int(data['guild_id']))
+    if key is None or guild is None:
+        return
+
+    context, command = key
+    entry = COMMANDS[key]
+    channel = guild.get_channel(int(data['channel_id']))
+    if context == STATIC and (channel is None or get_context(channel) != STATIC):
+        await interaction.send("Use this command inside a static channel.")
+        return
+
+    # Options become args, except members (targets) and the message to (un)pin (reference)
+    args, targets, reference = [], [], None
+    resolved = data['data'].get('resolved', {})
+    # Options come in the order the user typed them: put them in the order they are declared,
+    # which is the order of the args of the $ command
+    declared = [ opt['name'] for opt in entry.slash['options'] ]
+    options = sorted(data['data'].get('options', ()), key=lambda opt: declared.index(opt['name']))
+    for opt in options:
+        if opt['type'] == USER:
+            member = interaction_member(guild, opt['value'], resolved)
+            if member is not None:
+                targets.append(member)
+            else:
+                user = resolved['users'][opt['value']]
+                args.append(f"{user['username']}#{user['discriminator']}")
+        elif opt['name'] == 'message':
+            message_id = parse_message_id(opt['value'])
+            if message_id is None:
+                await interaction.send("Use the id or the link of the message.")
+                return
+            reference = discord.MessageReference(message_id=message_id, channel_id=channel.id, guild_id=guild.id)
+            reference._state = client._connection # for cached_message
+        elif opt['type'] == BOOLEAN:
+            if opt['value']:
+                args.append(opt['name'])
+        else:
+            args.append(str(opt['value']))
+
+    # DM commands answer privately, like in DMs
+    interaction.ephemeral = context == DM
+    author = discord.Member(data=data['member'], guild=guild, state=client._connection)
+    ctx = InteractionContext(interaction, channel, author, command, args, reference=reference, targets=targets)
+
+    # Interactions must be answered within 3 seconds: defer slow commands, and any command that has to wait
+    if entry.defer or len(scheduler):
+        await interaction.defer()
+
+    await dispatch(context, entry, ctx)
+
+    # Commands that don't answer (like $pin) still have to respond
+    if not interaction.responded:
+        await interaction.send("Done.", ephemeral=True)
+
+
+async def register_app_commands(guild_ids):
+    commands = { name: COMMANDS[key].slash for name, key in APP_COMMANDS.items() }
+    try:
+        application = await client.application_info()
+    except discord.HTTPException:
+        log.warning('Could not register the slash commands', exc_info=True)
+        return
+
+    for guild_id in guild_ids:
         try:
-            # Get these variables for later
-            guild = client.get_guild(GUILD_ID)
-            if guild is None: raise ValueError()
-            category = guild.get_channel(CATEGORY_ID)
-            if category is None: raise ValueError()
-        except ValueError:
-            await error_message(message.channel, "Guild/category was not found. Contact an admin.")
-
-        member = guild.get_member(message.author.id)
-        if member is None:
-            await message.channel.send("Discord tells me you're not in the server. If this is not the case, contact an @admin.")
-            return
-        elif has_role(member, BLACKLIST_ROLE_ID):
-            await error_message(message.channel, "You are blacklisted from using this bot.")
+            await register_guild_commands(client.http, application.id, guild_id, commands)
+            log.info('Registered %d slash commands in guild %s', len(commands), guild_id)
+        except discord.HTTPException:
+            log.warning('Could not register the slash commands in guild %s. '
+                'Was the bot invited with the applications.commands scope?', guild_id, exc_info=True)
+
+
+async def run_command(entry, ctx):
+    if metrics is None:
+        return await entry.handler(ctx)
+
+    # So that REST requests are counted for this command
+    token = current_command.set(ctx.command)
+    try:
+        return await entry.handler(ctx)
+    finally:
+        current_command.reset(token)
+
+
+# DM commands
+
+@command(DM, '$hello', member=False)
+async def dm_hello(ctx):
+    await ctx.reply('BEEP BOOP')
+
+
+@command(DM, '$help')
+async def dm_help(ctx):
+    await ctx.reply(DM_ADMIN_HELP if is_admin(ctx.member) else DM_HELP)
+
+
+def static_name(name):
+    """Turn a user-given group name into its channel name, or None if it starts with static."""
+    name = name.strip().lower()
+    if name.startswith('static'):
+        return None
+
+    return 'static-' + name.replace('_', '-')
+
+
+STATIC_PREFIX_ERROR = (
+    "Your group name should not start with static, as it will be automatically added by the bot.\n"
+    "Example: 'fridays' will become 'static-fridays'."
+)
+
+
+@command(DM, '$create', priority=PRIORITY_HIGH, defer=True, slash=slash_command(
+    'Create a new static group (with you inside)',
+    option(STRING, 'name', 'Group name, without static- (no whitespaces)', required=True),
+))
+async def dm_create(ctx):
+    args, member, guild = ctx.args, ctx.member, ctx.guild
+
+    if not args:
+        await error_message(ctx, "Error: Add the group name after the $create command.")
+        return
+    elif len(args) > 1:
+        await error_message(ctx, "Error: static name must not contain whitespaces.")
+        return
+    elif not channel_name_legal(args[0]):
+        await error_message(ctx, "Channel name can only contain lowercase English letters, numbers and dashes.")
+        return
+
+    one_channel_role_id = ctx.config.one_channel_role_id
+    if one_channel_role_id is not None and not is_admin(member) and has_role(member, one_channel_role_id):
+        await error_message(ctx, "Error: you cannot create more than one channel. "
+            "Ask a co-member to create it or an @admin to remove the restriction for you.")
+        return
+
+    name = static_name(args[0])
+    if name is None:
+        await error_message(ctx, STATIC_PREFIX_ERROR)
+        return
+
+    # Check that the group doesn't exist already
+    if get_channel_named(ctx.config, name) is not None:
+        await error_message(ctx, "Group name already exists.")
+        return
+
+    # Create the channel with the category permissions (what it would sync to)
+    # plus the view_channel permission for its creator, all in a single request.
+    overwrites = overwrites_by_id(ctx.category)
+    _, overwrite = overwrites.get(member.id, (member, discord.PermissionOverwrite()))
+    overwrite.update(view_channel=True)
+    overwrites[member.id] = (member, overwrite)
+
+    channel = await guild.create_text_channel(
+        name=name, category=ctx.category, overwrites=dict(overwrites.values()),
+        reason=f'{ctx.author_id} requested the channel.'
+    )
+    # Don't wait for the gateway event, so that a quick second $create sees it
+    ctx.config.channels.add(channel)
+    touch_activity(channel.id, channel.created_at)
+    index_static_members(channel)
+    registry.add(channel.id, member.id, channel.created_at, guild.id)
+
+    # The rest doesn't depend on each other, so do it concurrently
+    aws = [
+        ctx.reply("Group created, take a look in the server!"),
+        channel.send(f'Welcome to your new group {member.mention}!'),
+    ]
+
+    # Also add the one_channel role to the member
+    one_channel_role = guild.get_role(one_channel_role_id) if one_channel_role_id is not None else None
+    if one_channel_role is not None:
+        aws.append(member.add_roles(one_channel_role))
+
+    await asyncio.gather(*aws)
+
+
+@command(DM, '$delete', admin=True, defer=True, slash=slash_command(
+    'Delete a static group',
+    option(STRING, 'name', 'Group name, without static- (no whitespaces)', required=True),
+))
+async def dm_delete(ctx):
+    args, guild = ctx.args, ctx.guild
+
+    if not args:
+        await error_message(ctx, "Add the group name after the $delete command.")
+        return
+    elif len(args) > 1:
+        await error_message(ctx, "Error: static name must not contain whitespaces.")
+        return
+
+    name = static_name(args[0])
+    if name is None:
+        await error_message(ctx, STATIC_PREFIX_ERROR)
+        return
+
+    channel = get_channel_named(ctx.config, name)
+    if channel is None:
+        if discord.utils.get(guild.channels, name=name) is not None:
+            await ctx.reply(f"Group {name} is not a private static.")
+        else:
+            await ctx.reply(f"Group {name} doesn't exist.")
+        return
+
+    one_channel_role = get_one_channel_role(ctx.config, guild)
+    if one_channel_role:
+        creator_id = await get_creator_id(channel)
+        if creator_id is None:
+            await ctx.reply("Error: Channel creator not defined.")
             return
-        elif WHITELIST_ROLE_ID is not None and not has_role(member, WHITELIST_ROLE_ID):
-            await error_message(message.channel, "You are not whitelisted to use this bot.")
+
+        await release_one_channel_role(guild, one_channel_role, channel, creator_id)
+
+    await channel.delete(reason=f"{ctx.author_id} asked to delete it.")
+    registry.remove(channel.id)
+    await ctx.reply(f"Group {name} deleted.")
+
+
+def get_one_channel_role(config, guild):
+    return guild.get_role(config.one_channel_role_id) if config.one_channel_role_id is not None else None
+
+
+async def release_one_channel_role(guild, role, channel, creator_id):
+    # Only give the creator their channel back if this was the last one they created (in this guild)
+    creator = await fetch_member(guild, creator_id)
+    created = [ entry for entry in registry.created_by(creator_id) if guild.get_channel(entry.channel_id) is not None ]
+    if creator is not None and all(entry.channel_id == channel.id for entry in created):
+        await creator.remove_roles(role)
+
+
+async def find_creator_in_history(channel):
+    # The creator is mentioned in the first message of the channel
+    messages = await channel.history(limit=1, oldest_first=True).flatten()
+    if not messages or not messages[0].mentions:
+        return None
+
+    return messages[0].mentions[0].id
+
+
+async def get_creator_id(channel):
+    entry = registry.get(channel.id)
+    if entry is not None:
+        return entry.creator_id
+
+    # Created before the registry existed
+    return await find_creator_in_history(channel)
+
+
+async def register_from_history(channel, semaphore):
+    async with semaphore:
+        creator_id = await find_creator_in_history(channel)
+
+    if creator_id is not None:
+        registry.add(channel.id, creator_id, channel.created_at, channel.guild.id)
+
+    return creator_id is not None
+
+
+@command(DM, '$rebuild_registry', admin=True)
+async def dm_rebuild_registry(ctx):
+    unknown = [ channel for channel in ctx.config.channels if channel.id not in registry ]
+
+    semaphore = asyncio.Semaphore(HISTORY_CONCURRENCY)
+    found = await asyncio.gather(*(register_from_history(channel, semaphore) for channel in unknown))
+    await registry.flush()
+
+    s = f"Registered {sum(found)} new statics."
+    if not all(found):
+        s += " Creator not found for: " + ', '.join(channel.name for channel, ok in zip(unknown, found) if not ok)
+    await ctx.reply(s)
+
+
+async def fetch_last_activity(channel, semaphore):
+    async with semaphore:
+        messages = await channel.history(limit=1).flatten()
+
+    touch_activity(channel.id, messages[0].created_at if messages else channel.created_at)
+
+
+async def refresh_activity(channels):
+    # Most channels are known from on_message and their last_message_id,
+    # only ask Discord for the rest (a few at a time).
+    unknown = [ channel for channel in channels if channel.id not in last_activity ]
+    if unknown:
+        semaphore = asyncio.Semaphore(HISTORY_CONCURRENCY)
+        await asyncio.gather(*(fetch_last_activity(channel, semaphore) for channel in unknown))
+
+
+@command(DM, '$last_message', admin=True, defer=True, slash=slash_command(
+    'List all static channels in order of their last message date',
+))
+async def dm_last_message(ctx):
+    channels = ctx.category.text_channels
+    await refresh_activity(channels)
+
+    l = [ (channel.name, last_activity[channel.id]) for channel in channels ]
+    l = sorted(l, key=lambda pair: pair[1])
+    for content in split_message([ ' - '.join(map(str, pair)) for pair in l ], '\n'):
+        await ctx.reply(content)
+
+
+# Idle statics
+
+async def retire_static(guild, config, channel, archive):
+    """Archive channel in the archive category (delete it if None), releasing its creator's one-channel role."""
+    one_channel_role = get_one_channel_role(config, guild)
+    if one_channel_role:
+        creator_id = await get_creator_id(channel)
+        if creator_id is not None:
+            await release_one_channel_role(guild, one_channel_role, channel, creator_id)
+
+    reason = f'No messages for {IDLE_STATIC_DAYS} days.'
+    if archive is not None:
+        # on_guild_channel_update takes it out of the indexes
+        await channel.edit(category=archive, sync_permissions=True, reason=reason)
+    else:
+        await channel.delete(reason=reason)
+    registry.remove(channel.id)
+
+
+def name_list(names, limit=1500):
+    """Join names with commas, cutting the list to about limit characters."""
+    s = ''
+    for i, name in enumerate(names):
+        if len(s) + len(name) > limit:
+            return s + f' and {len(names) - i} more'
+        s += (', ' if s else '') + name
+
+    return s
+
+
+async def report_to_admins(guild, config, text):
+    channel = guild.get_channel(config.admin_channel_id) if config.admin_channel_id is not None else None
+    if channel is None:
+        log.info('%s: %s', guild.name, text)
+    else:
+        await channel.send(text)
+
+
+async def archive_guild_idle_statics(config):
+    guild = client.get_guild(config.id)
+    if guild is None:
+        return
+
+    archive = None
+    if config.archive_category_id is not None:
+        archive = guild.get_channel(config.archive_category_id)
+        if archive is None:
+            # Don't delete statics that were meant to be archived
+            log.warning('Archive category %s of %s not found, not archiving idle statics', config.archive_category_id, guild.name)
             return
 
-        splits = list(filter(bool, message.content.split(' ')))
-        command, args = (splits[0], splits[1:]) if splits else ('', tuple())
-        command = command.lower()
-        args = [ arg.strip() for arg in args if arg.strip() ]
-
-        author_id = f'{message.author.name} ({message.author.id})'
-
-        # If private message
-        if message.channel.type == discord.ChannelType.private:
-            if command == "$hello":
-                await message.channel.send('BEEP BOOP')
-
-            elif command == '$create':
-                if not args:
-                    await error_message(message.channel, "Error: Add the group name after the $create command.")
-                    return
-                elif len(args) > 1:
-                    await error_message(message.channel, "Error: static name must not contain whitespaces.")
-                    return
-                elif not channel_name_legal(args[0]):
-                    await error_message(message.channel, "Channel name can only contain lowercase English letters, numbers and dashes.")
-                    return
-
-                if ONE_CHANNEL_ROLE_ID is not None and not is_admin(member) and has_role(member, ONE_CHANNEL_ROLE_ID):
-                    await error_message(message.channel, "Error: you cannot create more than one channel. "
-                        "Ask a co-member to create it or an @admin to remove the restriction for you.")
-                    return
-
-                name = args[0].strip().lower()
-                if name.startswith('static'):
-                    await error_message(message.channel, (
-                        "Your group name should not start with static, as it will be automatically added by the bot.\n"
-                        "Example: 'fridays' will become 'static-fridays'."
-                    ))
-                    return
-                else:
-                    name = name.replace('_', '-')
-                    name = 'static-' + name
-
-                # Check that the group doesn't exist already
-                channels = await guild.fetch_channels()
-                if any(
-                    item.name.lower().strip() == name
-                    for item in channels
-                ):
-                    await error_message(message.channel, "Group name already exists.")
-                    return
-
-                channel = await guild.create_text_channel(
-                    name=name, category=category, 
-                    reason=f'{author_id} requested the channel.'
-                )
-
-                # After creation, set the view_channel permission. 
-                # Don't do it in create_channel because it will override the category permissions.
-                await channel.set_permissions(member, view_channel=True)
-
-                # Finally, also add the one_channel role to the member
-                one_channel_role = guild.get_role(ONE_CHANNEL_ROLE_ID) if ONE_CHANNEL_ROLE_ID is not None else None
-                if one_channel_role is not None:
-                    await member.add_roles(one_channel_role)
-
-                await message.channel.send("Group created, take a look in the server!")
-                await channel.send(f'Welcome to your new group {member.mention}!')
-
-            elif is_admin(member):
-                if command == '$delete':
-                    if not args:
-                        await error_message(message.channel, "Add the group name after the $delete command.")
-                        return
-                    elif len(args) > 1:
-                        await error_message(message.channel, "Error: static name must not contain whitespaces.")
-                        return
-
-                    name = args[0].strip().lower()
-                    if name.startswith('static'):
-                        await error_message(message.channel, (
-                            "Your group name should not start with static, as it will be automatically added by the bot.\n"
-                            "Example: 'fridays' will become 'static-fridays'."
-                        ))
-                        return
-                    else:
-                        name = name.replace('_', '-')
-                        name = 'static-' + name
-
-                        if category is None: raise ValueError()
-                        channel = await get_channel_named(name)
-                        if channel is None:
-                            await message.channel.send(f"Group {name} doesn't exist.")
-                        elif channel.category.id != CATEGORY_ID:
-                            await message.channel.send(f"Group {name} is not a private static.")
-                        else:
-                            one_channel_role = guild.get_role(ONE_CHANNEL_ROLE_ID) if ONE_CHANNEL_ROLE_ID is not None else None
-                            if one_channel_role:
-                                # Get the first message, where the creator is mentioned
-                                messages = await channel.history(limit=1, oldest_first=True).flatten()
-                                if not messages:
-                                    await message.channel.send("Error: Channel creator not defined.")
-                                    return
-                                else:
-                                    m, = messages
-                                    if not m.mentions:
-                                        await message.channel.send("Error: Channel creator not defined.")
-                                    else:
-                                        creator = m.mentions[0]
-                                        await creator.remove_roles(one_channel_role)
-
-                            await channel.delete(reason=f"{author_id} asked to delete it.")
-                            await message.channel.send(f"Group {name} deleted.")
-
-                elif command == '$last_message':
-                    l = []
-                    for channel in category.channels:
-                        if isinstance(channel, discord.TextChannel):
-                            messages = await channel.history(limit=1).flatten()                    
-                            created_at = messages[0].created_at if messages else channel.created_at
-
-                            l.append((channel.name, created_at))
-
-                    l = sorted(l, key=lambda pair: pair[1])
-                    await message.channel.send('\n'.join(' - '.join(map(str, pair)) for pair in l))
-
-                elif command == '$help':
-                    await message.channel.send(DM_ADMIN_HELP)
-
-            elif command == '$help':
-                await message.channel.send(DM_HELP)
-
-        # If group message (in CATEGORY_ID)
-        elif message.guild.id == GUILD_ID and \
-             message.channel.category.id == CATEGORY_ID:
-
-            if not message.content.startswith('$'):
-                return # ignore
-
-            assert command.startswith('$')
-            if command == "$hello":
-                message.channel.send('BEEP BOOP')
-
-            elif command == "$members":
-                await message.channel.send(
-                    'The members of this channel are: \n' + 
-                    '\n'.join(
-                        member.nick if member.nick else member.name 
-                        for member in get_static_members(message.channel)
-                    )
-                )
-
-            elif command == "$mention":
-                await message.channel.send(
-                    'Hey guys! ' + 
-                    ' '.join(member.mention for member in get_static_members(message.channel))
-                )
-
-            elif command == '$add':
-                try:
-                    guild = client.get_guild(GUILD_ID)
-                    if guild is None: raise ValueError()
-
-                    members = get_static_members(message.channel)
-
-                    # args are all members to add
-                    added_members = []
-                    members_set = set()
-                    errors = []
-                    for member_name in args:
-                        member = guild.get_member_named(member_name)
-
-                        if member is None:
-                            errors.append(member_name)
-                        elif member.id not in members_set and member not in members:
-                            await message.channel.set_permissions(member, view_channel=True)
-
-                            added_members.append(member.mention)
-                            members_set.add(member.id)
-
-                    errors = set(errors)
-                    if errors:
-                        await error_message(
-                            message.channel, 
-                            f"User{'s' if len(errors) > 1 else ''} {', '.join(errors)} "
-                            "could not be found. Make sure to use the NAME#XXXX format (i.e., DiscordLord#9999)."
-                        )
-
-                    if added_members:
-                        s = "Guys, say welcome to "
-                        if len(added_members) == 1:
-                            s += added_members[0]
-                        else:
-                            s += ', '.join(added_members[:-1]) + " and " + added_members[-1]
-                        s += "!"
-                        await message.channel.send(s)
-                    else:
-                        await message.channel.send("ERROR: No members to add!")
-
-                except ValueError:
-                    await error_message(message.channel, "Add member failed. Contact an admin.")
-                    return
-
-            elif command == '$remove':
-                try:
-                    guild = client.get_guild(GUILD_ID)
-                    if guild is None: raise ValueError()
-
-                    members = get_static_members(message.channel)
-
-                    # args are all members to add
-                    removed_members = []
-                    members_set = set()
-                    errors = []
-                    for member_name in args:
-                        member = guild.get_member_named(member_name)
-
-                        if member is None:
-                            errors.append(member_name)
-                        elif member.id not in members_set and member in members:
-                            await message.channel.set_permissions(member, overwrite=None)
-                            removed_members.append(member.mention)
-                            members_set.add(member.id)
-
-                    errors = set(errors)
-                    if errors:
-                        await error_message(
-                            message.channel, 
-                            f"User{'s' if len(errors) > 1 else ''} {', '.join(errors)} "
-                            "could not be found. Make sure to use the NAME#XXXX format (i.e., DiscordLord#9999)."
-                        )
-
-                    if removed_members:
-                        s = "Guys, say goodbye to "
-                        if len(removed_members) == 1:
-                            s += removed_members[0]
-                        else:
-                            s += ', '.join(removed_members[:-1]) + " and " + removed_members[-1]
-                        s += "!"
-                        await message.channel.send(s)
-                    else:
-                        await message.channel.send("ERROR: No members to remove!")
-
-                except ValueError:
-                    await error_message(message.channel, "Add member failed. Contact an admin.")
-                    return
-
-            elif command == '$pin':
-                if message.reference is None:
-                    prev_message = await get_previous_message(message)
-                    if prev_message is None:
-                        reference_id = None
-                    else:
-                        reference_id = prev_message.id
-                else:
-                    reference_id = message.reference.message_id
+    channels = list(config.channels)
+    await refresh_activity(channels)
 
-                if reference_id is None:
-                    await error_message(message.channel, "No messages to pin yet.")
-                else:
-                    try:
-                        reference = await message.channel.fetch_message(reference_id)
-                        if not reference.pinned:
-                            await reference.pin(reason=f"{author_id} requested the pin.")
-                        else:
-                            await error_message(message.channel, "The specified message is already pinned.")
-                    except discord.NotFound: 
-                        await error_message(message.channel, "The specified message was not found.")
-
-            elif command == '$unpin':
-                if message.reference is None:
-                    await error_message(message.channel, "You need to reply to the message you want to $unpin.")                
+    idle_since = datetime.datetime.utcnow() - datetime.timedelta(days=IDLE_STATIC_DAYS)
+    idle = sorted(
+        (channel for channel in channels if channel.id in last_activity and last_activity[channel.id] < idle_since),
+        key=lambda channel: last_activity[channel.id]
+    )
+    if not idle:
+        return
+
+    # In batches, to stay well within the rate limits of channel changes
+    done, failed = [], []
+    for i in range(0, len(idle), IDLE_BATCH_SIZE):
+        if i:
+            await asyncio.sleep(IDLE_BATCH_DELAY)
+
+        for channel in idle[i:i + IDLE_BATCH_SIZE]:
+            try:
+                await retire_static(guild, config, channel, archive)
+                done.append(channel.name)
+            except discord.HTTPException:
+                log.warning('Could not retire idle static %s', channel.name, exc_info=True)
+                failed.append(channel.name)
+
+    s = f"{'Archived' if archive is not None else 'Deleted'} {len(done)} statics without messages for {IDLE_STATIC_DAYS} days"
+    s += f": {name_list(done)}." if done else "."
+    if failed:
+        s += f"\nCould not {'archive' if archive is not None else 'delete'}: {name_list(failed)}."
+    await report_to_admins(guild, config, s)
+
+
+async def archive_idle_statics():
+    while not client.is_closed():
+        await asyncio.sleep(IDLE_CHECK_INTERVAL)
+
+        for config in list(guilds.values()):
+            # A failure in a guild (e.g. missing permissions) must not stop the next checks
+            try:
+                await archive_guild_idle_statics(config)
+            except Exception:
+                log.exception('Could not archive the idle statics of guild %s', config.id)
+
+
+# Static channel commands
+
+@command(STATIC, '$hello', member=False)
+async def static_hello(ctx):
+    await ctx.reply('BEEP BOOP')
+
+
+@command(STATIC, '$help', member=False)
+async def static_help(ctx):
+    await ctx.reply(CHANNEL_HELP)
+
+
+@command(STATIC, '$members', priority=PRIORITY_LOW, slash=slash_command(
+    'List all members of this static',
+))
+async def static_list_members(ctx):
+    for content in await get_member_list(ctx.channel, '$members'):
+        await ctx.reply(content)
+
+
+@command(STATIC, '$mention', priority=PRIORITY_LOW, slash=slash_command(
+    'Mention all members of this static',
+))
+async def static_mention(ctx):
+    for content in await get_member_list(ctx.channel, '$mention'):
+        await ctx.reply(content)
+
+
+def enumerate_mentions(mentions):
+    """Join mentions as 'a, b and c'."""
+    if len(mentions) == 1:
+        return mentions[0]
+    else:
+        return ', '.join(mentions[:-1]) + " and " + mentions[-1]
+
+
+async def report_not_found(ctx, errors):
+    errors = list(dict.fromkeys(errors)) # without duplicates, in order
+    if errors:
+        s = (
+            f"User{'s' if len(errors) > 1 else ''} {', '.join(errors)} "
+            "could not be found. Make sure to use the NAME#XXXX format (i.e., DiscordLord#9999)."
+        )
+
+        member_names = ctx.config.member_names
+        if member_names.ready:
+            for name in errors:
+                suggestions = member_names.suggest(name)
+                if suggestions:
+                    s += f"\nDid you mean {' or '.join(suggestions)} instead of {name}?"
+
+        await error_message(ctx, s)
+
+
+def overwrites_by_id(channel):
+    """Target id -> (target, overwrite) for every overwrite of channel.
+
+    Unlike channel.overwrites, members missing from the cache are kept (as discord.Object),
+    so that writing the map back doesn't drop their overwrites.
+    """
+    overwrites = { target.id: (target, overwrite) for target, overwrite in channel.overwrites.items() }
+
+    for raw in channel._overwrites:
+        if raw.type == 'member' and raw.id not in overwrites:
+            overwrite = discord.PermissionOverwrite.from_pair(discord.Permissions(raw.allow), discord.Permissions(raw.deny))
+            overwrites[raw.id] = (discord.Object(id=raw.id), overwrite)
+
+    return overwrites
+
+
+async def apply_overwrites(channel, changes, reason=None):
+    """Apply a list of (member, overwrite or None) to channel.
+
+    In batched mode all changes go in a single channel edit,
+    falling back to one request per member if the edit fails.
+    """
+    if not changes:
+        return
+
+    if BATCH_OVERWRITES:
+        # The whole map is written back, so concurrent edits of a channel would undo each other
+        async with overwrite_locks.setdefault(channel.id, asyncio.Lock()):
+            overwrites = overwrites_by_id(channel)
+            for member, overwrite in changes:
+                if overwrite is None:
+                    overwrites.pop(member.id, None)
                 else:
-                    try:
-                        reference = await message.channel.fetch_message(message.reference.message_id)
-                        if reference.pinned:
-                            await reference.unpin(reason=f"{author_id} requested the unpin.")
-                            await message.channel.send('Unpinned message.', reference=reference)
-                        else:
-                            await error_message(message.channel, "The specified message is not pinned.")
-                    except discord.NotFound: 
-                        await error_message(message.channel, "The specified message was not found.")
+                    overwrites[member.id] = (member, overwrite)
+
+            try:
+                # discord.py updates channel from the response, so the next edit starts from it
+                await channel.edit(overwrites=dict(overwrites.values()), reason=reason)
+                return
+            except discord.Forbidden:
+                raise # per-member requests would fail too
+            except discord.HTTPException:
+                pass
+
+    for member, overwrite in changes:
+        await channel.set_permissions(member, overwrite=overwrite, reason=reason)
+
+
+async def query_member_named(guild, name):
+    """Like guild.get_member_named, but asking Discord (for LOW_MEMORY)."""
+    username, discriminator = name, None
+    if len(name) > 5 and name[-5] == '#':
+        username, discriminator = name[:-5], name[-4:]
+
+    candidates = await guild.query_members(query=username, limit=100, cache=False)
+
+    member = None
+    if discriminator is not None:
+        member = discord.utils.get(candidates, name=username, discriminator=discriminator)
+    if member is None:
+        member = discord.utils.find(
+            lambda m: m.name == name or (m.nick is not None and m.nick.casefold() == name.casefold()),
+            candidates
+        )
+
+    if member is not None:
+        guilds[guild.id].member_cache.put(member)
+
+    return member
+
+
+async def find_member_named(guild, name):
+    member_names = guilds[guild.id].member_names
+    if member_names.ready:
+        member_id = member_names.lookup(name)
+        return guild.get_member(member_id) if member_id is not None else None
+    elif LOW_MEMORY or not guild.chunked:
+        return await query_member_named(guild, name)
+    else:
+        return guild.get_member_named(name)
+
+
+async def resolve_members(guild, names):
+    """Resolve member names, ignoring duplicates. Returns (members, names not found)."""
+    members = {}
+    errors = []
+    for member_name in names:
+        member = await find_member_named(guild, member_name)
+
+        if member is None:
+            errors.append(member_name)
+        else:
+            members[member.id] = member
 
-            elif command == '$clear' and is_admin(member):
-                limit = args[0] if args else '100' 
+    return list(members.values()), errors
 
-                try:
-                    limit = int(limit) + 1 # + 1 to include the $clear message
-                except ValueError:
-                    await error_message(message.channel, "Unrecognized limit number.")
 
-                await message.channel.purge(limit=limit)
+# Slash commands take up to this many members at once
+MEMBER_OPTIONS = 5
+
+
+def member_options(verb):
+    return [
+        option(USER, f'member{i + 1}', f'Member to {verb}', required=i == 0)
+        for i in range(MEMBER_OPTIONS)
+    ]
+
+
+async def command_members(ctx):
+    """Members a command is about: its targets (slash commands) or the names in its args."""
+    if ctx.targets is not None:
+        return list({ member.id: member for member in ctx.targets }.values()), ctx.args
+
+    return await resolve_members(ctx.guild, ctx.args)
+
+
+@command(STATIC, '$add', slash=slash_command('Add members to this static', *member_options('add')))
+async def static_add(ctx):
+    # args are all members to add
+    members, errors = await command_members(ctx)
+    members = [ member for member in members if not is_static_member(ctx.channel, member) ]
+
+    await apply_overwrites(
+        ctx.channel,
+        [ (member, discord.PermissionOverwrite(view_channel=True)) for member in members ],
+        reason=f'{ctx.author_id} added members.'
+    )
+
+    # Don't wait for the channel update event
+    for member in members:
+        if not has_role(member, ctx.config.bots_role_id):
+            static_members.setdefault(ctx.channel.id, set()).add(member.id)
+    if members:
+        member_lists.pop(ctx.channel.id, None)
 
-            elif command == '$help':
-                await message.channel.send(CHANNEL_HELP)
+    await report_not_found(ctx, errors)
 
+    if members:
+        await ctx.reply(f"Guys, say welcome to {enumerate_mentions([ member.mention for member in members ])}!")
+    else:
+        await ctx.reply("ERROR: No members to add!")
+
+
+@command(STATIC, '$remove', slash=slash_command('Remove members from this static', *member_options('remove')))
+async def static_remove(ctx):
+    # args are all members to remove
+    members, errors = await command_members(ctx)
+    members = [ member for member in members if is_static_member(ctx.channel, member) ]
+
+    await apply_overwrites(
+        ctx.channel,
+        [ (member, None) for member in members ],
+        reason=f'{ctx.author_id} removed members.'
+    )
+
+    # Don't wait for the channel update event
+    for member in members:
+        static_members[ctx.channel.id].discard(member.id)
+    if members:
+        member_lists.pop(ctx.channel.id, None)
+
+    await report_not_found(ctx, errors)
+
+    if members:
+        await ctx.reply(f"Guys, say goodbye to {enumerate_mentions([ member.mention for member in members ])}!")
+    else:
+        await ctx.reply("ERROR: No members to remove!")
+
+
+@command(STATIC, '$pin', priority=PRIORITY_LOW, merge=False, slash=slash_command(
+    'Pin a message (the last one by default)',
+    option(STRING, 'message', 'Id or link of the message to pin'),
+))
+async def static_pin(ctx):
+    try:
+        if ctx.reference is None:
+            reference = await get_previous_message(ctx.channel, ctx.message)
         else:
-            # Talking in public channel, ignore
-            pass
-                        
-    except discord.Forbidden:
-        await error_message(message.channel, "Bot doesn't have the permissions required for this action (@admin).")
-    except discord.HTTPException:
-        await error_message(message.channel, "Something unexpected happened. Please try again in a few minutes.")
+            reference = await resolve_message(ctx.channel, ctx.reference)
+
+        if reference is None:
+            await error_message(ctx, "No messages to pin yet.")
+        elif not reference.pinned:
+            recent_messages.expect_pin_update(ctx.channel.id)
+            try:
+                await reference.pin(reason=f"{ctx.author_id} requested the pin.")
+            except discord.HTTPException:
+                recent_messages.pin_update_failed(ctx.channel.id)
+                raise
+        else:
+            await error_message(ctx, "The specified message is already pinned.")
+    except discord.NotFound:
+        await error_message(ctx, "The specified message was not found.")
+
+
+@command(STATIC, '$unpin', priority=PRIORITY_LOW, merge=False, slash=slash_command(
+    'Unpin a message',
+    option(STRING, 'message', 'Id or link of the message to unpin', required=True),
+))
+async def static_unpin(ctx):
+    if ctx.reference is None:
+        await error_message(ctx, "You need to reply to the message you want to $unpin.")
+        return
+
+    try:
+        reference = await resolve_message(ctx.channel, ctx.reference)
+        if reference.pinned:
+            recent_messages.expect_pin_update(ctx.channel.id)
+            try:
+                await reference.unpin(reason=f"{ctx.author_id} requested the unpin.")
+            except discord.HTTPException:
+                recent_messages.pin_update_failed(ctx.channel.id)
+                raise
+            await ctx.reply('Unpinned message.', reference=reference)
+        else:
+            await error_message(ctx, "The specified message is not pinned.")
+    except discord.NotFound:
+        await error_message(ctx, "The specified message was not found.")
+
+
+@command(STATIC, '$clear', admin=True, defer=True, slash=slash_command(
+    'Delete the last messages of this static, in the background',
+    option(BOOLEAN, 'cancel', 'Stop the clear running in this static'),
+    option(INTEGER, 'limit', 'Messages to delete (100 by default)'),
+))
+async def static_clear(ctx):
+    limit = ctx.args[0] if ctx.args else '100'
+
+    if limit == 'cancel':
+        if not purger.cancel(ctx.channel.id):
+            await error_message(ctx, "There is no clear running in this channel.")
+        return
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        await error_message(ctx, "Unrecognized limit number.")
+        return
 
+    if ctx.channel.id in purger:
+        await error_message(ctx, "This channel is already being cleared. Use `$clear cancel` to stop it.")
+        return
 
-async def error_message(channel, message):
-    await channel.send(message)
+    # Runs in the background, reporting its progress in the channel.
+    # A slash command clears the messages before it, not its own response.
+    before = discord.Object(id=int(ctx.interaction.id)) if ctx.message is None else None
+    await purger.start(ctx.channel, limit, message=ctx.message, send=ctx.reply, before=before)
+
+
+async def error_message(ctx, message):
+    await ctx.reply(message)
 
 def is_admin(member):
-    return any( role.id == ADMIN_ROLE_ID for role in member.roles )
+    return has_role(member, guilds[member.guild.id].admin_role_id)
+
+async def get_previous_message(channel, message=None):
+    """The message before message in channel (the last message of channel if message is None)."""
+    previous = recent_messages.last(channel.id) if message is None else recent_messages.previous(message)
+    if previous is not None:
+        return previous
 
-async def get_previous_message(message):
-    l = await message.channel.history(limit=1, before=message).flatten()
+    l = await channel.history(limit=1, before=message).flatten()
 
     if l:
         return l[0]
     else:
         return None
 
-async def get_channel_named(name):
-    guild = client.get_guild(GUILD_ID)
-    if guild is None: 
-        await error_message(message.channel, "Guild/category was not found. Contact an admin.")
-        return
-    channels = await guild.fetch_channels()
+async def resolve_message(channel, reference):
+    """The message a reply refers to.
 
-    for channel in channels:
-        if channel.name == name:
-            return channel
+    Looked up in the reply itself, then in the message caches, and only then asked to Discord.
+    """
+    if isinstance(reference.resolved, discord.Message):
+        return reference.resolved
 
-async def get_role_named(name):
-    guild = client.get_guild(GUILD_ID)
-    if guild is None: 
-        await error_message(message.channel, "Guild/category was not found. Contact an admin.")
-        return
-    roles = await guild.fetch_roles()
+    message = recent_messages.get(channel.id, reference.message_id) or reference.cached_message
+    if message is not None:
+        return message
+
+    return await channel.fetch_message(reference.message_id)
 
-    for role in roles:
-        if role.name == name:
-            return role
+def get_channel_named(config, name):
+    """Static channel of the guild of config called name, or None."""
+    return config.channels.get(name)
+
+def get_role_named(config, name):
+    """Role of the guild of config called name, or None."""
+    return config.roles.get(name)
 
 def channel_name_legal(name):
     import string
     return set(name) <= set(string.ascii_letters.lower()).union(set('-0123456789'))
 
 def has_role(member, role_id):
-    return any(
-        role.id == role_id
-        for role in member.roles
-    )
+    return role_id in role_ids(member)
+
+async def get_static_members(channel):
+    assert is_static_channel(channel)
+    bots_role_id = guilds[channel.guild.id].bots_role_id
+
+    if channel.id not in static_members:
+        index_static_members(channel)
+
+    member_ids = sorted(static_members[channel.id])
+    members = [ get_cached_member(channel.guild, member_id) for member_id in member_ids ]
+
+    # Only when LOW_MEMORY or before the member chunk: fetch the ones not cached (a few at a time)
+    missing = [ member_id for member_id, member in zip(member_ids, members) if member is None ]
+    if missing and (LOW_MEMORY or not channel.guild.chunked):
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
 
-def get_static_members(channel):
-    assert channel.category_id == CATEGORY_ID
+        async def fetch(member_id):
+            async with semaphore:
+                return await fetch_member(channel.guild, member_id)
+
+        fetched = dict(zip(missing, await asyncio.gather(*(fetch(member_id) for member_id in missing))))
+        members = [ member if member is not None else fetched[member_id] for member_id, member in zip(member_ids, members) ]
 
     return [
         member
-        for member in channel.members 
-        if not has_role(member, BOTS_ROLE_ID) and
-        channel.overwrites_for(member).view_channel
+        for member in members
+        if member is not None and not has_role(member, bots_role_id)
     ]
 
 
-# Start the bot
-client.run(TOKEN)
\ No newline at end of file
+def split_message(parts, separator, limit=MESSAGE_LIMIT):
+    """Join parts with separator, in as few messages of up to limit characters as possible."""
+    messages = []
+    for part in parts:
+        if messages and len(messages[-1]) + len(separator) + len(part) <= limit:
+            messages[-1] += separator + part
+        else:
+            messages.append(part[:limit])
+
+    return messages
+
+
+async def get_member_list(channel, command):
+    """Messages listing ($members) or mentioning ($mention) the members of a static."""
+    lists = member_lists.setdefault(channel.id, {})
+    if command in lists:
+        return lists[command]
+
+    members = await get_static_members(channel)
+    if command == '$members':
+        messages = split_message(
+            [ 'The members of this channel are: ' ] + [ member.nick if member.nick else member.name for member in members ],
+            '\n'
+        )
+    else:
+        messages = split_message([ 'Hey guys!' ] + [ member.mention for member in members ], ' ')
+
+    # Unless the members changed while they were fetched
+    if member_lists.get(channel.id) is lists:
+        lists[command] = messages
+    return messages
+
+
+def create_app(conf, conf_path=None):
+    """Configure the bot with conf (the contents of conf.json) and return its client, ready to run.
+
+    If conf_path is given, its guild settings are reloaded when the file changes.
+    The bot keeps its state in this module, so there can only be one app per process.
+    """
+    global client, registry, snapshot, user_limiter, command_limiter, scheduler, purger, metrics, CONF_PATH
+    global guilds, last_activity, static_members, member_lists, overwrite_locks, recent_messages, background_tasks
+
+    for k, v in conf.items():
+        globals()[k] = v
+    CONF_PATH = conf_path
+
+    # Create client
+    # The members intent is required for some functionalities
+    intents = discord.Intents.default()
+    intents.members = True
+
+    # A single connection, or as many shards as Discord recommends
+    client_class = discord.AutoShardedClient if SHARDED else discord.Client
+    if LOW_MEMORY:
+        # Members are fetched when needed and kept in the member cache of each guild instead
+        client = client_class(
+            intents=intents,
+            member_cache_flags=discord.MemberCacheFlags.none(),
+            chunk_guilds_at_startup=False
+        )
+    else:
+        client = client_class(intents=intents)
+
+    for handler in EVENTS:
+        client.event(handler)
+    parsers = client._connection.parsers
+    parsers['GUILD_CREATE'] = functools.partial(parse_guild_create, parsers['GUILD_CREATE'])
+    if SLASH_COMMANDS:
+        parsers['INTERACTION_CREATE'] = parse_interaction_create
+
+    registry = StaticRegistry(REGISTRY_PATH)
+    snapshot = StateSnapshot(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+    user_limiter = RateLimiter(*USER_RATE_LIMIT) if USER_RATE_LIMIT else None
+    command_limiter = RateLimiter(*COMMAND_RATE_LIMIT) if COMMAND_RATE_LIMIT else None
+    scheduler = Scheduler(workers=SCHEDULER_WORKERS, max_pending=SCHEDULER_MAX_PENDING)
+    purger = Purger(max_jobs=PURGE_MAX_JOBS, report_interval=PURGE_REPORT_INTERVAL)
+
+    # Nothing is measured unless it is exposed somewhere
+    metrics = None
+    if METRICS_PORT or METRICS_LOG_INTERVAL:
+        metrics = Metrics()
+        metrics.instrument(client)
+
+    # Start from empty indexes
+    guilds = load_guilds(conf)
+    last_activity = {}
+    static_members = {}
+    member_lists = {}
+    overwrite_locks = {}
+    recent_messages = RecentMessages(MESSAGE_CACHE_SIZE)
+    background_tasks = []
+
+    # Or from the last snapshot, checked against Discord as guilds arrive
+    if snapshot is not None:
+        restore_snapshot(snapshot.load())
+
+    return client
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    # Get bot token
+    with open('token.txt') as f:
+        token = f.read().replace('\n', '').strip()
+
+    # Get configuration variables
+    with open(sys.argv[1]) as f:
+        conf = json.load(f)
+
+    client = create_app(conf, conf_path=sys.argv[1])
+
+    # Start the bot
+    try:
+        client.run(token)
+    finally:
+        registry.close()
+        if snapshot is not None:
+            snapshot.save(snapshot_state())
+
+
+if __name__ == '__main__':
+    main()
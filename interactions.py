@@ -0,0 +1,127 @@
+import re
+
+from discord.http import Route
+
+
+# Application command option types
+STRING = 3
+INTEGER = 4
+BOOLEAN = 5
+USER = 6
+
+# Interaction types and response types
+APPLICATION_COMMAND = 2
+CHANNEL_MESSAGE = 4
+DEFERRED_CHANNEL_MESSAGE = 5
+
+# Message flag: only the user who ran the command sees the response
+EPHEMERAL = 1 << 6
+
+MESSAGE_LINK = re.compile(r'(?:/channels/\d+/\d+/)?(\d+)/?$')
+
+
+class APIRoute(Route):
+    """Route of an endpoint that discord.py's default API version doesn't have."""
+    BASE = 'https://discord.com/api/v10'
+
+
+def slash_command(description, *options):
+    """Registration data of a slash command (its name is added when registering)."""
+    return { 'type': 1, 'description': description, 'options': list(options) }
+
+
+def option(type, name, description, required=False):
+    return { 'type': type, 'name': name, 'description': description, 'required': required }
+
+
+async def register_guild_commands(http, application_id, guild_id, commands):
+    """Replace the slash commands of a guild by commands (name -> slash_command data)."""
+    payload = [ dict(data, name=name) for name, data in commands.items() ]
+    route = APIRoute(
+        'PUT', '/applications/{application_id}/guilds/{guild_id}/commands',
+        application_id=application_id, guild_id=guild_id
+    )
+    return await http.request(route, json=payload)
+
+
+def parse_message_id(value):
+    """Message id from an id or a message link, or None."""
+    match = MESSAGE_LINK.search(value.strip())
+    return int(match.group(1)) if match else None
+
+
+class Interaction:
+    """Responds to an application command interaction (from its gateway payload).
+
+    The first response answers the interaction (or completes it if it was deferred),
+    the next ones are sent as follow-up messages.
+    """
+
+    def __init__(self, http, data, ephemeral=False):
+        self.http = http
+        self.id = data['id']
+        self.application_id = data['application_id']
+        self.token = data['token']
+        self.ephemeral = ephemeral
+
+        self.deferred = False
+        self.responded = False
+
+    def _flags(self, ephemeral=None):
+        return EPHEMERAL if (self.ephemeral if ephemeral is None else ephemeral) else 0
+
+    async def _callback(self, type, data=None):
+        route = APIRoute(
+            'POST', '/interactions/{interaction_id}/{interaction_token}/callback',
+            interaction_id=self.id, interaction_token=self.token
+        )
+        payload = { 'type': type }
+        if data is not None:
+            payload['data'] = data
+
+        await self.http.request(route, json=payload)
+
+    async def defer(self):
+        """Acknowledge the interaction, to respond later (within 15 minutes)."""
+        if not self.deferred and not self.responded:
+            await self._callback(DEFERRED_CHANNEL_MESSAGE, { 'flags': self._flags() })
+            self.deferred = True
+
+    async def send(self, content, ephemeral=None):
+        """Respond, returning the InteractionMessage sent.
+
+        ephemeral overrides the interaction default, except when completing a deferred response.
+        """
+        if self.responded:
+            route = APIRoute(
+                'POST', '/webhooks/{application_id}/{interaction_token}',
+                application_id=self.application_id, interaction_token=self.token
+            )
+            data = await self.http.request(route, json={ 'content': content, 'flags': self._flags(ephemeral) })
+            return InteractionMessage(self, data['id'])
+
+        if self.deferred:
+            await self.edit('@original', content)
+        else:
+            await self._callback(CHANNEL_MESSAGE, { 'content': content, 'flags': self._flags(ephemeral) })
+
+        self.responded = True
+        return InteractionMessage(self, '@original')
+
+    async def edit(self, message_id, content):
+        route = APIRoute(
+            'PATCH', '/webhooks/{application_id}/{interaction_token}/messages/{message_id}',
+            application_id=self.application_id, interaction_token=self.token, message_id=message_id
+        )
+        await self.http.request(route, json={ 'content': content })
+
+
+class InteractionMessage:
+    """A response to an interaction. Can be edited like a discord.Message."""
+
+    def __init__(self, interaction, message_id):
+        self.interaction = interaction
+        self.id = message_id
+
+    async def edit(self, *, content):
+        await self.interaction.edit(self.id, content)
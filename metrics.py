@@ -0,0 +1,208 @@
+import json
+import bisect
+import asyncio
+import logging
+import contextvars
+import collections
+
+from aiohttp import web
+
+
+# Command run by the current task, to know which command each REST call belongs to
+current_command = contextvars.ContextVar('current_command', default=None)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# Message discord.py logs (as a warning) when a request gets a 429
+RATE_LIMITED_LOG = 'We are being rate limited.'
+GLOBAL_RATE_LIMITED_LOG = 'Global rate limit has been hit.'
+
+
+class Histogram:
+    """Prometheus-style histogram: counts of observations per upper bound."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q quantile (inf if above every bucket)."""
+        if not self.count:
+            return 0.
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+        return float('inf')
+
+
+class RateLimitLogHandler(logging.Handler):
+    """Counts the 429s (and the time waited for them) that discord.py logs."""
+
+    def __init__(self, metrics):
+        super().__init__(level=logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if not isinstance(record.msg, str) or not record.args:
+            return
+
+        if record.msg.startswith(RATE_LIMITED_LOG):
+            self.metrics.rate_limited('route', record.args[0])
+        elif record.msg.startswith(GLOBAL_RATE_LIMITED_LOG):
+            self.metrics.rate_limited('global', record.args[0])
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    """Counters and histograms of the bot's hot paths.
+
+    Exposed in the Prometheus text format (render, or serve for an HTTP endpoint)
+    and as a periodic JSON log line (log_periodically).
+    """
+
+    PREFIX = 'staticbot'
+
+    def __init__(self):
+        self.commands = {} # command -> latency Histogram
+        self.rest_calls = collections.Counter() # (command, route) -> requests
+        self.errors = collections.Counter() # (command, error class) -> count
+        self.rate_limits = collections.Counter() # scope -> 429s
+        self.rate_limit_wait = 0. # seconds
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.loop_lag_max = 0. # since last log line
+
+    # Recording
+
+    def observe_command(self, command, seconds):
+        histogram = self.commands.get(command)
+        if histogram is None:
+            histogram = self.commands[command] = Histogram(LATENCY_BUCKETS)
+
+        histogram.observe(seconds)
+
+    def rest_call(self, route):
+        self.rest_calls[(current_command.get() or '', route)] += 1
+
+    def error(self, command, name):
+        self.errors[(command, name)] += 1
+
+    def rate_limited(self, scope, retry_after):
+        self.rate_limits[scope] += 1
+        self.rate_limit_wait += retry_after
+
+    def instrument(self, client):
+        """Count the REST requests and 429s of a discord.Client."""
+        request = client.http.request
+
+        async def counted_request(route, **kwargs):
+            self.rest_call(f'{route.method} {route.path}')
+            return await request(route, **kwargs)
+
+        client.http.request = counted_request
+        logging.getLogger('discord.http').addHandler(RateLimitLogHandler(self))
+
+    async def measure_loop_lag(self, interval=1.):
+        """Forever, measure how late the event loop wakes up from a sleep."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0., loop.time() - start - interval)
+
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    # Exposing
+
+    def render(self):
+        """Metrics in the Prometheus text format."""
+        p = self.PREFIX
+        lines = []
+
+        def histogram(name, h, **labels):
+            seen = 0
+            for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                seen += count
+                lines.append(f'{p}_{name}_bucket{_labels(**labels, le=bound)} {seen}')
+            lines.append(f'{p}_{name}_sum{_labels(**labels)} {h.sum}')
+            lines.append(f'{p}_{name}_count{_labels(**labels)} {h.count}')
+
+        lines.append(f'# TYPE {p}_command_duration_seconds histogram')
+        for command, h in sorted(self.commands.items()):
+            histogram('command_duration_seconds', h, command=command)
+
+        lines.append(f'# TYPE {p}_rest_requests_total counter')
+        for (command, route), count in sorted(self.rest_calls.items()):
+            lines.append(f'{p}_rest_requests_total{_labels(command=command, route=route)} {count}')
+
+        lines.append(f'# TYPE {p}_command_errors_total counter')
+        for (command, error), count in sorted(self.errors.items()):
+            lines.append(f'{p}_command_errors_total{_labels(command=command, error=error)} {count}')
+
+        lines.append(f'# TYPE {p}_rate_limited_total counter')
+        for scope, count in sorted(self.rate_limits.items()):
+            lines.append(f'{p}_rate_limited_total{_labels(scope=scope)} {count}')
+        lines.append(f'# TYPE {p}_rate_limit_wait_seconds_total counter')
+        lines.append(f'{p}_rate_limit_wait_seconds_total {self.rate_limit_wait}')
+
+        lines.append(f'# TYPE {p}_event_loop_lag_seconds histogram')
+        histogram('event_loop_lag_seconds', self.loop_lag)
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Dict with the main figures, for the log line."""
+        return {
+            'commands': {
+                command: {
+                    'count': h.count,
+                    'mean_ms': round(1000 * h.sum / h.count, 1) if h.count else 0,
+                    'p99_ms_le': 1000 * h.quantile(.99),
+                }
+                for command, h in sorted(self.commands.items())
+            },
+            'rest_requests': sum(self.rest_calls.values()),
+            'errors': { f'{command} {error}': count for (command, error), count in sorted(self.errors.items()) },
+            'rate_limited': dict(self.rate_limits),
+            'rate_limit_wait_s': round(self.rate_limit_wait, 3),
+            'loop_lag_max_ms': round(1000 * self.loop_lag_max, 1),
+        }
+
+    async def log_periodically(self, logger, interval):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info('metrics %s', json.dumps(self.summary(), sort_keys=True))
+            self.loop_lag_max = 0.
+
+    async def serve(self, host, port):
+        """Start serving GET /metrics on host:port. Returns the runner (to clean it up)."""
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
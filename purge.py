@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import logging
+
+import discord
+
+
+log = logging.getLogger('static-bot')
+
+# Discord only bulk deletes messages younger than 14 days, up to 100 per request.
+# The margin covers messages that get too old between being listed and being deleted.
+BULK_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=10)
+BULK_MAX_COUNT = 100
+
+
+class PurgeJob:
+    """Deletion of the last `limit` messages of a channel, before message (deleted too) if given.
+
+    Otherwise, the messages deleted are before `before` (a discord.abc.Snowflake), if given.
+    """
+
+    def __init__(self, channel, limit, message=None, send=None, before=None):
+        self.channel = channel
+        self.limit = limit
+        self.message = message
+        self.before = message if message is not None else before
+        self.total = limit + 1 if message is not None else limit
+        self.send = send or channel.send # to report progress, returns something with edit(content=...)
+
+        self.deleted = 0
+        self.status = None # message where the progress is reported
+        self.task = None
+        self.running = False # the task started (before that, it can't handle its cancellation)
+        self.cancelled = False
+
+    def progress(self):
+        return f"Cleared {self.deleted}/{self.total} messages..."
+
+    async def report(self, text):
+        try:
+            if self.status is None:
+                self.status = await self.send(text)
+            else:
+                await self.status.edit(content=text)
+        except discord.HTTPException:
+            # Progress is informative, the purge goes on without it
+            log.warning('Could not report the progress of a clear in %s', self.channel, exc_info=True)
+
+    async def delete(self, messages):
+        """Delete messages, with a bulk request if there are several (they must be recent enough)."""
+        if len(messages) > 1:
+            await self.channel.delete_messages(messages)
+        elif messages:
+            try:
+                await messages[0].delete()
+            except discord.NotFound:
+                pass
+
+        self.deleted += len(messages)
+
+    async def run(self, report_interval):
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + report_interval
+
+        batch = [ self.message ] if self.message is not None else []
+        bulk_after = datetime.datetime.utcnow() - BULK_MAX_AGE
+
+        # History comes newest first: once a message is too old to bulk delete, all the next ones are
+        async for message in self.channel.history(limit=self.limit, before=self.before):
+            if message.created_at >= bulk_after:
+                batch.append(message)
+                if len(batch) == BULK_MAX_COUNT:
+                    await self.delete(batch)
+                    batch = []
+            else:
+                await self.delete(batch)
+                batch = []
+                await self.delete([ message ])
+
+            # Requests are sequential, discord.py waits out the rate limit of each route
+            if loop.time() >= next_report:
+                await self.report(self.progress())
+                next_report = loop.time() + report_interval
+
+        await self.delete(batch)
+
+
+class Purger:
+    """Runs the purges of channels in the background: one job per channel, up to max_jobs at a time.
+
+    Jobs beyond max_jobs wait for a running one to finish.
+    """
+
+    def __init__(self, max_jobs=3, report_interval=10):
+        self.max_jobs = max_jobs
+        self.report_interval = report_interval
+
+        self._jobs = {} # channel id -> PurgeJob
+        self._semaphore = None # created on first use, inside the event loop
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._jobs
+
+    async def start(self, channel, limit, message=None, send=None, before=None):
+        """Start a purge (see PurgeJob), once its first progress report is sent. Returns the job."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+
+        job = self._jobs[channel.id] = PurgeJob(channel, limit, message=message, send=send, before=before)
+        queued = self._semaphore.locked()
+        try:
+            await job.report("Other channels are being cleared, this one will start soon..." if queued else job.progress())
+        finally:
+            job.task = asyncio.get_running_loop().create_task(self._run(job, queued))
+
+        return job
+
+    def cancel(self, channel_id):
+        """Stop the purge of a channel. Returns whether there was one."""
+        job = self._jobs.get(channel_id)
+        if job is None:
+            return False
+
+        # A job that is still starting stops as soon as it runs
+        job.cancelled = True
+        if job.running:
+            job.task.cancel()
+        return True
+
+    def cancel_all(self):
+        for channel_id in list(self._jobs):
+            self.cancel(channel_id)
+
+    async def _run(self, job, queued):
+        job.running = True
+        try:
+            if job.cancelled:
+                raise asyncio.CancelledError()
+
+            async with self._semaphore:
+                if queued:
+                    await job.report(job.progress())
+                await job.run(self.report_interval)
+
+            await job.report(f"Cleared {job.deleted} messages.")
+        except asyncio.CancelledError:
+            await job.report(f"Clear cancelled after deleting {job.deleted} messages.")
+        except discord.Forbidden:
+            await job.report(f"Clear stopped after deleting {job.deleted} messages: missing permissions (@admin).")
+        except discord.HTTPException as e:
+            log.warning('Clear of %s failed', job.channel, exc_info=True)
+            await job.report(f"Clear stopped after deleting {job.deleted} messages: Discord error {e.status}.")
+        finally:
+            if self._jobs.get(job.channel.id) is job:
+                del self._jobs[job.channel.id]
@@ -0,0 +1,139 @@
+import time
+import asyncio
+import itertools
+
+
+# Scheduler priorities, lower runs first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated', 'warned')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.warned = False
+
+
+class RateLimiter:
+    """Token bucket per key: allows `rate` hits every `per` seconds (with bursts of up to `rate`).
+
+    Buckets idle for longer than `per` are full again, so they are equivalent to a new one
+    and are evicted: memory only grows with the keys used recently.
+    """
+
+    def __init__(self, rate, per, clock=time.monotonic):
+        self.rate = rate
+        self.per = per
+        self.clock = clock
+
+        self._buckets = {}
+        self._next_sweep = clock() + per
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _sweep(self, now):
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if now - bucket.updated < self.per
+        }
+        self._next_sweep = now + self.per
+
+    def consume(self, key):
+        """Take a token for key. Returns whether there was one."""
+        now = self.clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, now)
+        else:
+            bucket.tokens = min(self.rate, bucket.tokens + (now - bucket.updated) * self.rate / self.per)
+            bucket.updated = now
+
+        if bucket.tokens < 1:
+            return False
+
+        bucket.tokens -= 1
+        bucket.warned = False
+        return True
+
+    def warn(self, key):
+        """Whether to warn key about being rate limited: only the first time in a row."""
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.warned:
+            return False
+
+        bucket.warned = True
+        return True
+
+
+class Busy(Exception):
+    """The scheduler has too much pending work to accept more."""
+
+
+class Scheduler:
+    """Runs submitted work with a few workers, by priority (then arrival order).
+
+    Work submitted with the key of a pending or running job is not run again:
+    it gets the result of that job instead.
+    Once max_pending jobs are waiting, submit raises Busy.
+    """
+
+    def __init__(self, workers=4, max_pending=50):
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._queue = None # created on first use, inside the event loop
+        self._tasks = []
+        self._inflight = {} # key -> future
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [ loop.create_task(self._work()) for _ in range(self.workers) ]
+
+    def submit(self, priority, factory, key=None):
+        """Schedule factory() (a coroutine function) and return a future with its result."""
+        if self._queue is None:
+            self._start()
+
+        if key is not None and key in self._inflight:
+            return self._inflight[key]
+        elif self._queue.qsize() >= self.max_pending:
+            raise Busy()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._counter), factory, future))
+
+        if key is not None:
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return future
+
+    async def _work(self):
+        while True:
+            _, _, factory, future = await self._queue.get()
+
+            try:
+                if not future.done():
+                    result = await factory()
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,94 @@
+import asyncio
+import sqlite3
+import datetime
+import collections
+import concurrent.futures
+
+
+# guild_id is None for statics registered before it was recorded
+StaticEntry = collections.namedtuple('StaticEntry', ('channel_id', 'creator_id', 'created_at', 'guild_id'))
+
+
+class StaticRegistry:
+    """Local record of the static channels created by the bot, and who created them.
+
+    Everything is served from memory. Changes are queued and written to an
+    SQLite file in batches, in a background thread, so they never block the event loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {} # channel id -> StaticEntry
+        self._pending = [] # queued (sql, params), in order
+
+        # A single thread, so that writes are applied in order
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS statics ('
+                'channel_id INTEGER PRIMARY KEY, creator_id INTEGER NOT NULL, created_at TEXT NOT NULL, guild_id INTEGER)'
+            )
+            # Added after the first version of the table
+            columns = [ row[1] for row in self._db.execute('PRAGMA table_info(statics)') ]
+            if 'guild_id' not in columns:
+                self._db.execute('ALTER TABLE statics ADD COLUMN guild_id INTEGER')
+
+        rows = self._db.execute('SELECT channel_id, creator_id, created_at, guild_id FROM statics')
+        for channel_id, creator_id, created_at, guild_id in rows:
+            self._entries[channel_id] = StaticEntry(channel_id, creator_id, datetime.datetime.fromisoformat(created_at), guild_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, channel_id):
+        return channel_id in self._entries
+
+    def get(self, channel_id):
+        return self._entries.get(channel_id)
+
+    def created_by(self, creator_id):
+        return [ entry for entry in self._entries.values() if entry.creator_id == creator_id ]
+
+    def add(self, channel_id, creator_id, created_at, guild_id):
+        entry = self._entries[channel_id] = StaticEntry(channel_id, creator_id, created_at, guild_id)
+        self._pending.append((
+            'INSERT OR REPLACE INTO statics (channel_id, creator_id, created_at, guild_id) VALUES (?, ?, ?, ?)',
+            (channel_id, creator_id, created_at.isoformat(), guild_id)
+        ))
+
+        return entry
+
+    def remove(self, channel_id):
+        if self._entries.pop(channel_id, None) is not None:
+            self._pending.append(('DELETE FROM statics WHERE channel_id = ?', (channel_id,)))
+
+    def _write(self, pending):
+        with self._db:
+            for sql, params in pending:
+                self._db.execute(sql, params)
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, pending)
+
+    async def run(self, interval):
+        """Flush pending changes every interval seconds, forever."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def close(self):
+        """Write any pending change and close the database. Blocking, meant for shutdown."""
+        self._executor.shutdown()
+
+        pending, self._pending = self._pending, []
+        self._write(pending)
+        self._db.close()
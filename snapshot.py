@@ -0,0 +1,77 @@
+import os
+import json
+import asyncio
+import logging
+import datetime
+
+
+log = logging.getLogger('static-bot')
+
+# Bumped when the format changes: snapshots of other versions are ignored
+VERSION = 1
+
+
+class StateSnapshot:
+    """The state the bot derives from Discord, saved to a JSON file to resume quickly after a restart.
+
+    The state is a dict of static channel id -> (member ids, datetime of last activity or None).
+    It is only a head start: whatever it says is checked against Discord once the bot is connected.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """The saved state, or an empty one if there is no usable snapshot."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            log.warning('Could not read the snapshot %s, starting without it', self.path, exc_info=True)
+            return {}
+
+        if data.get('version') != VERSION:
+            log.warning('Ignoring the snapshot %s, saved by another version of the bot', self.path)
+            return {}
+
+        return {
+            int(channel_id): (
+                set(static['members']),
+                datetime.datetime.fromisoformat(static['last_activity']) if static['last_activity'] else None
+            )
+            for channel_id, static in data['statics'].items()
+        }
+
+    def save(self, state):
+        """Write state. Blocking; the file is replaced at once, so it is never left half written."""
+        data = {
+            'version': VERSION,
+            'saved_at': datetime.datetime.utcnow().isoformat(),
+            'statics': {
+                str(channel_id): {
+                    'members': sorted(members),
+                    'last_activity': last_activity.isoformat() if last_activity is not None else None,
+                }
+                for channel_id, (members, last_activity) in state.items()
+            },
+        }
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    async def write(self, state):
+        """Like save, in a thread so that it doesn't block the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.save, state)
+
+    async def run(self, interval, get_state):
+        """Save get_state() every interval seconds, forever."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.write(get_state())
+            except OSError:
+                log.warning('Could not write the snapshot %s', self.path, exc_info=True)
@@ -0,0 +1,294 @@
+import asyncio
+import argparse
+
+import discord
+
+import bot
+import metrics
+import bench.run as bench_run
+from bench.run import Bench
+
+
+def run_bot(scenario, **options):
+    """Run scenario(bench) against the bot on a fake Discord (see bench/), once it is ready."""
+    args = dict(
+        seed=0, low_memory=False, latency=0.005, jitter=0, members=30,
+        statics=2, static_size=3, concurrency=4, commands=5
+    )
+    args.update(options)
+
+    async def main():
+        bench = Bench(argparse.Namespace(**args))
+        bench.setup()
+        await bot.on_ready()
+        try:
+            return await scenario(bench)
+        finally:
+            for task in bot.background_tasks:
+                task.cancel()
+            bot.registry.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_pins_of_different_messages_all_run():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        targets = [ world.add_message(channel_id, world.users[members[0]], f'Message {i}') for i in range(2) ]
+
+        await asyncio.gather(*(
+            bot.on_message(world.post(channel, members[0], '$pin', reference_id=target['id']))
+            for target in targets
+        ))
+        return [ world.find_message(channel_id, target['id'])['pinned'] for target in targets ]
+
+    assert run_bot(scenario) == [ True, True ]
+
+
+def test_concurrent_adds_in_a_channel_keep_every_member():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        added = [ member_id for member_id in bench.member_ids[1:] if member_id not in members ][:2]
+
+        await asyncio.gather(*(
+            bot.on_message(world.post(channel, members[0], f'$add {bench.tag(member_id)}'))
+            for member_id in added
+        ))
+        await asyncio.sleep(0.05) # channel update events
+
+        on_discord = { int(overwrite['id']) for overwrite in world.channels[channel_id]['permission_overwrites'] }
+        return [ member_id in on_discord and member_id in bot.static_members[channel_id] for member_id in added ]
+
+    assert run_bot(scenario) == [ True, True ]
+
+
+def test_registry_keeps_the_statics_of_guilds_not_served():
+    async def scenario(bench):
+        channel_id, members = bench.statics[0]
+        bot.registry.add(channel_id, members[0], bench.guild.get_channel(channel_id).created_at, bench.guild.id)
+        # A static of a guild that is not in the configuration anymore
+        bot.registry.add(1, members[0], bench.guild.get_channel(channel_id).created_at, 999)
+        # A static of the served guild that was deleted while the bot was offline
+        bot.registry.add(2, members[0], bench.guild.get_channel(channel_id).created_at, bench.guild.id)
+
+        bot.rebuild_indexes()
+        return { entry.channel_id for entry in bot.registry } == { 1, channel_id }
+
+    assert run_bot(scenario)
+
+
+def test_member_lists_are_refreshed_when_a_bot_becomes_a_member():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+
+        world.update_member_roles(members[0], add=bench_run.BOTS_ROLE_ID)
+        await asyncio.sleep(0.01)
+        before = await bot.get_member_list(channel, '$mention')
+
+        world.update_member_roles(members[0], remove=bench_run.BOTS_ROLE_ID)
+        await asyncio.sleep(0.01)
+        after = await bot.get_member_list(channel, '$mention')
+
+        return before[0].count('<@'), after[0].count('<@')
+
+    assert run_bot(scenario) == (2, 3)
+
+
+def test_failed_pins_dont_hide_later_pin_updates():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        target = world.post(channel, members[0], 'Raid on friday')
+        await bot.on_message(target)
+        await bot.on_message(world.post(channel, members[0], 'Raid on saturday'))
+
+        # The pin fails (e.g. the channel has 50 pins already)
+        async def pin_message(channel_id, message_id, reason=None):
+            raise discord.HTTPException(FakeResponse(400), 'Maximum number of pins reached')
+        world.http.pin_message, pin = pin_message, world.http.pin_message
+        await bot.on_message(world.post(channel, members[0], '$pin'))
+        world.http.pin_message = pin
+
+        # Someone else pins the cached message: the bot must not trust its cached flag anymore
+        world.find_message(channel_id, target.id)['pinned'] = True
+        await bot.on_guild_channel_pins_update(channel, None)
+        await bot.on_message(world.post(channel, members[0], '$unpin', reference_id=target.id))
+
+        return world.find_message(channel_id, target.id)['pinned']
+
+    assert run_bot(scenario) is False
+
+
+class FakeResponse:
+
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'error'
+
+
+def test_failed_slash_commands_are_answered():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+
+        data = world.interaction(bench.guild.get_channel(channel_id), members[0], 'add', [ (6, 'member1', '1') ])
+        del data['data']['resolved'] # malformed payload
+        await bot.on_interaction(data)
+
+        return [ json['data']['content'] for _, _, json in world.interaction_responses if 'data' in json ]
+
+    assert run_bot(scenario) == [ "Something unexpected happened. Please try again in a few minutes." ]
+
+
+def test_idle_archiver_survives_errors():
+    async def scenario(bench):
+        checks = []
+
+        async def archive_guild_idle_statics(config):
+            checks.append(config.id)
+            raise discord.Forbidden(FakeResponse(403), 'Missing Access')
+
+        bot.archive_guild_idle_statics, original = archive_guild_idle_statics, bot.archive_guild_idle_statics
+        bot.IDLE_CHECK_INTERVAL, interval = 0.01, bot.IDLE_CHECK_INTERVAL
+        try:
+            task = asyncio.get_running_loop().create_task(bot.archive_idle_statics())
+            await asyncio.sleep(0.05)
+            task.cancel()
+        finally:
+            bot.archive_guild_idle_statics = original
+            bot.IDLE_CHECK_INTERVAL = interval
+
+        return len(checks) > 1
+
+    assert run_bot(scenario)
+
+
+def test_clear_cancelled_while_starting_stops():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        for i in range(30):
+            world.add_message(channel_id, world.users[members[0]], f'Message {i}')
+
+        clear = asyncio.get_running_loop().create_task(bot.on_message(world.post(channel, bench.admin_id, '$clear 20')))
+        await asyncio.sleep(0.001) # sending its first progress report
+        await bot.on_message(world.post(channel, bench.admin_id, '$clear cancel'))
+        await clear
+        await asyncio.sleep(0.05)
+
+        return [ message['content'] for message in world.messages[channel_id] if message['author']['id'] == world.bot_user['id'] ][-1:]
+
+    assert run_bot(scenario) == [ 'Clear cancelled after deleting 0 messages.' ]
+
+
+def test_slash_options_are_read_by_name():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, _ = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        cancelled = []
+        bot.purger.cancel, cancel = (lambda channel_id: cancelled.append(channel_id) or True), bot.purger.cancel
+
+        await bot.on_interaction(world.interaction(channel, bench.admin_id, 'clear', [ (4, 'limit', 50), (5, 'cancel', True) ]))
+        bot.purger.cancel = cancel
+        return cancelled == [ channel_id ]
+
+    assert run_bot(scenario)
+
+
+def test_blacklisting_applies_at_once_with_low_memory():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        dm = world.dm_channel(members[1])
+
+        # Cached with their roles by earlier commands
+        await bot.on_message(world.post(channel, members[1], '$mention'))
+        await bot.on_message(world.post(dm, members[1], '$last_message'))
+        world.update_member_roles(members[1], add=bench_run.BLACKLIST_ROLE_ID)
+        await asyncio.sleep(0.01)
+
+        await bot.on_message(world.post(channel, members[1], '$mention'))
+        await bot.on_message(world.post(dm, members[1], '$help'))
+        return [ world.messages[channel_id][-1]['content'], world.messages[dm.id][-1]['content'] ]
+
+    assert run_bot(scenario, low_memory=True) == [ "You are blacklisted from using this bot." ] * 2
+
+
+def test_users_outside_the_server_are_asked_for_once():
+    async def scenario(bench):
+        world = bench.world
+        world.user_payload(9999, 'stranger', '9999')
+        dm = world.dm_channel(9999)
+
+        for _ in range(3):
+            await bot.on_message(world.post(dm, 9999, '$help'))
+        return world.http.calls['get_member'], world.messages[dm.id][-1]['content']
+
+    calls, reply = run_bot(scenario, low_memory=True)
+    assert calls == 1
+    assert "not in the server" in reply
+
+
+def test_slash_clear_keeps_its_response():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        posted = [ world.add_message(channel_id, world.users[members[0]], f'Message {i}')['id'] for i in range(8) ]
+
+        await bot.on_interaction(world.interaction(channel, bench.admin_id, 'clear', [ (4, 'limit', 5) ]))
+        await bot.purger._jobs[channel_id].task
+        await asyncio.sleep(0.05)
+
+        remaining = { message['id'] for message in world.messages[channel_id] }
+        responses = [ message['content'] for message in world.messages[channel_id] if message['author']['id'] == world.bot_user['id'] ]
+        return [ id in remaining for id in posted ], responses
+
+    kept, responses = run_bot(scenario)
+    assert kept == [ True ] * 3 + [ False ] * 5
+    assert responses[-1] == "Cleared 5 messages."
+
+
+def test_last_message_is_split_in_messages_discord_accepts():
+    async def scenario(bench):
+        world = bench.world
+        dm = world.dm_channel(bench.admin_id)
+        await bot.on_message(world.post(dm, bench.admin_id, '$last_message'))
+
+        replies = [ message['content'] for message in world.messages[dm.id] if message['author']['id'] == world.bot_user['id'] ]
+        return len(replies), sum(reply.count('\n') + 1 for reply in replies)
+
+    replies, lines = run_bot(scenario, statics=80)
+    assert replies > 1
+    assert lines == 80
+
+
+def test_checks_of_a_command_are_counted_for_it():
+    async def scenario(bench):
+        world = bench.world
+        channel_id, members = bench.statics[0]
+        channel = bench.guild.get_channel(channel_id)
+        seen = []
+
+        async def check_rate_limits(ctx):
+            seen.append(metrics.current_command.get())
+            return await original(ctx)
+
+        bot.check_rate_limits, original = check_rate_limits, bot.check_rate_limits
+        try:
+            await bot.on_message(world.post(channel, members[0], '$members'))
+        finally:
+            bot.check_rate_limits = original
+        return seen, metrics.current_command.get()
+
+    assert run_bot(scenario) == ([ '$members' ], None)
@@ -0,0 +1,48 @@
+import asyncio
+import collections
+
+from bot import MemberNameIndex
+
+
+Member = collections.namedtuple('Member', ('id', 'name', 'discriminator', 'nick'))
+
+
+def build(*members):
+    index = MemberNameIndex()
+    asyncio.run(index.build(members))
+    return index
+
+
+def test_lookup_by_tag_name_or_nickname():
+    index = build(Member(1, 'alice', '0001', 'Captain'), Member(2, 'bob', '0002', None))
+
+    assert index.ready
+    assert index.lookup('alice#0001') == 1
+    assert index.lookup('bob') == 2
+    assert index.lookup('captain') == 1 # nicknames are case-insensitive
+    assert index.lookup('Alice') is None # usernames are not
+    assert index.lookup('carol') is None
+
+
+def test_updates_replace_the_old_names():
+    alice = Member(1, 'alice', '0001', 'Captain')
+    index = build(alice)
+
+    index.add(alice._replace(nick='Pilot'))
+    assert index.lookup('captain') is None
+    assert index.lookup('pilot') == 1
+
+    index.remove(alice)
+    assert index.lookup('alice') is None
+    assert len(index) == 0
+
+
+def test_suggestions_by_prefix():
+    index = build(
+        Member(1, 'alice', '0001', None), Member(2, 'alicia', '0002', None),
+        Member(3, 'bob', '0003', 'Alien'), Member(4, 'carol', '0004', None),
+    )
+
+    assert index.suggest('ali') == [ 'alice#0001', 'alicia#0002', 'bob#0003' ]
+    assert index.suggest('ALI#1234', limit=1) == [ 'alice#0001' ]
+    assert index.suggest('dave') == []
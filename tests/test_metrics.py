@@ -0,0 +1,29 @@
+import logging
+
+from metrics import Metrics, RateLimitLogHandler
+
+
+def log(handler, msg, *args):
+    handler.emit(logging.LogRecord('discord.http', logging.WARNING, __file__, 0, msg, args, None))
+
+
+def test_rate_limit_waits_are_summed_for_every_scope():
+    metrics = Metrics()
+    handler = RateLimitLogHandler(metrics)
+
+    log(handler, 'We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"', 1.5, 'bucket')
+    log(handler, 'Global rate limit has been hit. Retrying in %.2f seconds.', 2.25)
+    log(handler, 'Some other warning')
+
+    assert metrics.rate_limits == { 'route': 1, 'global': 1 }
+    assert metrics.rate_limit_wait == 3.75
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    metrics = Metrics()
+    for seconds in (0.005, 0.02, 0.02, 40):
+        metrics.observe_command('$pin', seconds)
+
+    histogram = metrics.commands['$pin']
+    assert histogram.quantile(.5) == 0.025
+    assert histogram.quantile(1) == float('inf')
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+from purge import PurgeJob, Purger
+
+
+class FakeMessage:
+
+    def __init__(self, channel, message_id, age):
+        self.channel = channel
+        self.id = message_id
+        self.created_at = datetime.datetime.utcnow() - age
+
+    async def delete(self):
+        self.channel.deleted.append([ self.id ])
+
+
+class FakeChannel:
+    """Messages newest first, as channel.history returns them."""
+
+    def __init__(self, ages):
+        self.id = 1
+        self.messages = [ FakeMessage(self, i, age) for i, age in enumerate(ages) ]
+        self.deleted = [] # ids of each delete request
+        self.sent = []
+
+    async def _history(self, limit, before):
+        messages = self.messages
+        if before is not None:
+            messages = messages[messages.index(before) + 1:]
+        for message in messages[:limit]:
+            yield message
+
+    def history(self, limit, before=None):
+        return self._history(limit, before)
+
+    async def delete_messages(self, messages):
+        assert 1 < len(messages) <= 100
+        self.deleted.append([ message.id for message in messages ])
+
+    async def send(self, content):
+        self.sent.append(content)
+        return FakeStatus(self)
+
+
+class FakeStatus:
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def edit(self, content):
+        self.channel.sent.append(content)
+
+
+RECENT = datetime.timedelta(days=1)
+OLD = datetime.timedelta(days=20)
+
+
+def test_recent_messages_are_deleted_in_bulk_batches():
+    channel = FakeChannel([ RECENT ] * 250)
+    job = PurgeJob(channel, 250)
+    asyncio.run(job.run(report_interval=60))
+
+    assert [ len(ids) for ids in channel.deleted ] == [ 100, 100, 50 ]
+    assert job.deleted == 250
+
+
+def test_messages_too_old_for_bulk_deletes_are_deleted_one_by_one():
+    channel = FakeChannel([ RECENT ] * 3 + [ OLD ] * 2)
+    job = PurgeJob(channel, 5)
+    asyncio.run(job.run(report_interval=60))
+
+    assert channel.deleted == [ [ 0, 1, 2 ], [ 3 ], [ 4 ] ]
+
+
+def test_the_command_message_is_deleted_with_the_limit_before_it():
+    channel = FakeChannel([ RECENT ] * 5)
+    command = channel.messages[0]
+    job = PurgeJob(channel, 2, message=command)
+    asyncio.run(job.run(report_interval=60))
+
+    assert channel.deleted == [ [ 0, 1, 2 ] ]
+    assert job.progress() == 'Cleared 3/3 messages...'
+
+
+def test_purger_reports_the_result():
+    async def main():
+        channel = FakeChannel([ RECENT ] * 3)
+        purger = Purger(max_jobs=1)
+        job = await purger.start(channel, 3)
+        assert channel.id in purger
+        await job.task
+        return channel.sent, channel.id in purger
+
+    sent, running = asyncio.run(main())
+    assert sent == [ 'Cleared 0/3 messages...', 'Cleared 3 messages.' ]
+    assert not running
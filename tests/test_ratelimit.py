@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from ratelimit import RateLimiter, Scheduler, Busy, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_allows_bursts_up_to_rate():
+    limiter = RateLimiter(3, 10, clock=Clock())
+
+    assert [ limiter.consume('a') for _ in range(4) ] == [ True, True, True, False ]
+    # Keys don't share tokens
+    assert limiter.consume('b')
+
+
+def test_rate_limiter_refills_over_time():
+    clock = Clock()
+    limiter = RateLimiter(2, 10, clock=clock)
+    limiter.consume('a')
+    limiter.consume('a')
+
+    clock.now = 4 # 0.8 tokens
+    assert not limiter.consume('a')
+    clock.now = 5 # 0.8 + 0.2
+    assert limiter.consume('a')
+    assert not limiter.consume('a')
+
+
+def test_rate_limiter_warns_once_in_a_row():
+    clock = Clock()
+    limiter = RateLimiter(1, 10, clock=clock)
+    limiter.consume('a')
+
+    assert not limiter.consume('a')
+    assert limiter.warn('a')
+    assert not limiter.warn('a')
+
+    clock.now = 10
+    assert limiter.consume('a')
+    assert not limiter.consume('a')
+    assert limiter.warn('a')
+
+
+def test_rate_limiter_evicts_idle_buckets():
+    clock = Clock()
+    limiter = RateLimiter(1, 10, clock=clock)
+    limiter.consume('a')
+    clock.now = 5
+    limiter.consume('b')
+    assert len(limiter) == 2
+
+    clock.now = 12 # 'a' is full again, 'b' is not
+    limiter.consume('c')
+    assert len(limiter) == 2
+    assert not limiter.consume('b')
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_scheduler_runs_by_priority_then_arrival():
+    async def main():
+        scheduler = Scheduler(workers=1)
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+            return run
+
+        futures = [
+            scheduler.submit(PRIORITY_LOW, job('low')),
+            scheduler.submit(PRIORITY_NORMAL, job('normal 1')),
+            scheduler.submit(PRIORITY_HIGH, job('high')),
+            scheduler.submit(PRIORITY_NORMAL, job('normal 2')),
+        ]
+        await asyncio.gather(*futures)
+        return order
+
+    assert run(main()) == [ 'high', 'normal 1', 'normal 2', 'low' ]
+
+
+def test_scheduler_merges_pending_jobs_with_the_same_key():
+    async def main():
+        scheduler = Scheduler(workers=1)
+        calls = []
+
+        async def job():
+            calls.append(1)
+            return len(calls)
+
+        first = scheduler.submit(PRIORITY_NORMAL, job, key='k')
+        second = scheduler.submit(PRIORITY_NORMAL, job, key='k')
+        other = scheduler.submit(PRIORITY_NORMAL, job, key='other')
+        results = await asyncio.gather(first, second, other)
+
+        # Once done, the key can run again
+        again = await scheduler.submit(PRIORITY_NORMAL, job, key='k')
+        return results, again
+
+    assert run(main()) == ([ 1, 1, 2 ], 3)
+
+
+def test_scheduler_passes_exceptions_to_the_submitter():
+    async def main():
+        scheduler = Scheduler(workers=1)
+
+        async def fail():
+            raise ValueError('boom')
+
+        async def ok():
+            return 'ok'
+
+        with pytest.raises(ValueError):
+            await scheduler.submit(PRIORITY_NORMAL, fail)
+        # The worker survives
+        return await scheduler.submit(PRIORITY_NORMAL, ok)
+
+    assert run(main()) == 'ok'
+
+
+def test_scheduler_is_busy_when_too_much_is_pending():
+    async def main():
+        scheduler = Scheduler(workers=1, max_pending=2)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        futures = [ scheduler.submit(PRIORITY_NORMAL, job) ]
+        await asyncio.sleep(0) # the worker takes the first one
+        futures += [ scheduler.submit(PRIORITY_NORMAL, job) for _ in range(2) ]
+
+        with pytest.raises(Busy):
+            scheduler.submit(PRIORITY_NORMAL, job)
+
+        release.set()
+        await asyncio.gather(*futures)
+
+    run(main())
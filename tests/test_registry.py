@@ -0,0 +1,40 @@
+import sqlite3
+import datetime
+
+from registry import StaticRegistry
+
+
+def test_registry_persists_entries(tmp_path):
+    path = str(tmp_path / 'statics.db')
+    created_at = datetime.datetime(2024, 1, 2, 3, 4, 5)
+
+    registry = StaticRegistry(path)
+    registry.add(1, 10, created_at, 100)
+    registry.add(2, 20, created_at, 100)
+    registry.remove(2)
+    registry.close()
+
+    registry = StaticRegistry(path)
+    assert list(registry) == [ (1, 10, created_at, 100) ]
+    assert registry.created_by(10)[0].guild_id == 100
+    registry.close()
+
+
+def test_registry_upgrades_tables_without_guild_ids(tmp_path):
+    path = str(tmp_path / 'statics.db')
+    db = sqlite3.connect(path)
+    with db:
+        db.execute(
+            'CREATE TABLE statics ('
+            'channel_id INTEGER PRIMARY KEY, creator_id INTEGER NOT NULL, created_at TEXT NOT NULL)'
+        )
+        db.execute("INSERT INTO statics VALUES (1, 10, '2024-01-02T03:04:05')")
+    db.close()
+
+    registry = StaticRegistry(path)
+    assert registry.get(1).guild_id is None
+
+    registry.add(1, 10, registry.get(1).created_at, 100)
+    registry.close()
+
+    assert StaticRegistry(path).get(1).guild_id == 100
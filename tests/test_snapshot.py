@@ -0,0 +1,34 @@
+import json
+import datetime
+
+from snapshot import StateSnapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot = StateSnapshot(str(tmp_path / 'state.json'))
+    state = {
+        1: ({ 10, 11 }, datetime.datetime(2024, 1, 2, 3, 4, 5)),
+        2: (set(), None),
+    }
+    snapshot.save(state)
+
+    assert snapshot.load() == state
+    assert not (tmp_path / 'state.json.tmp').exists()
+
+
+def test_missing_snapshot_is_empty(tmp_path):
+    assert StateSnapshot(str(tmp_path / 'state.json')).load() == {}
+
+
+def test_snapshots_of_other_versions_are_ignored(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text(json.dumps({ 'version': 0, 'statics': { '1': { 'members': [ 10 ], 'last_activity': None } } }))
+
+    assert StateSnapshot(str(path)).load() == {}
+
+
+def test_corrupt_snapshots_are_ignored(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('{"version": 1, "stat')
+
+    assert StateSnapshot(str(path)).load() == {}
@@ -0,0 +1,29 @@
+from bot import split_message
+
+
+def test_short_lists_fit_in_one_message():
+    assert split_message([ 'Hey guys!', 'a', 'b' ], ' ') == [ 'Hey guys! a b' ]
+
+
+def test_messages_are_filled_up_to_the_limit():
+    parts = [ 'x' * 4 ] * 5 # 'xxxx xxxx' is 9 characters
+    assert split_message(parts, ' ', limit=9) == [ 'xxxx xxxx', 'xxxx xxxx', 'xxxx' ]
+
+
+def test_split_messages_keep_every_part_in_order():
+    parts = [ 'The members of this channel are: ' ] + [ f'member{i}' for i in range(500) ]
+    messages = split_message(parts, '\n')
+
+    assert all(len(message) <= 2000 for message in messages)
+    assert '\n'.join(messages).split('\n') == parts
+    # As few as possible: each message couldn't take the first part of the next one
+    for message, following in zip(messages, messages[1:]):
+        assert len(message) + 1 + len(following.split('\n')[0]) > 2000
+
+
+def test_parts_longer_than_the_limit_are_cut():
+    assert split_message([ 'x' * 10 ], ' ', limit=4) == [ 'xxxx' ]
+
+
+def test_no_parts_no_messages():
+    assert split_message([], ' ') == []